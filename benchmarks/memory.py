@@ -0,0 +1,147 @@
+"""
+Memory held by the call state of a tag.
+
+Every benchmark renders a template that records the traced memory right before
+the tag call and again inside `render()`, and reports the difference: the memory
+allocated to get from the template code into the tag (the arguments, the call
+frame and its binding to the current context). The `baseline/*` benchmarks call
+a plain global function instead.
+
+Usage:
+
+    python benchmarks/memory.py
+    python benchmarks/memory.py --json results.json
+    python benchmarks/memory.py --compare results.json
+"""
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+import tracemalloc
+from pathlib import Path
+
+import jinja2
+from jinja2 import Environment, nodes
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import jinja2_simple_tags  # noqa: E402
+from jinja2_simple_tags import ContainerTag, StandaloneTag  # noqa: E402
+
+marks = []
+
+
+def mark():
+    marks.append(tracemalloc.get_traced_memory()[0])
+    return ""
+
+
+class ProbeTag(StandaloneTag):
+    tags = {"probe"}
+
+    def render(self, *args, **kwargs):
+        return mark()
+
+
+class LegacyProbeTag(ProbeTag):
+    """
+    Calls the tag through `render_wrapper()` with the metadata keywords,
+    the way the templates compiled by older versions did.
+    """
+    tags = {"legacy_probe"}
+
+    def create_node(self, parser, args, kwargs, *, lineno, **options):
+        call_node = self.call_method("render_wrapper", args, kwargs, lineno=lineno)
+        return nodes.Output([call_node], lineno=lineno)
+
+
+class ContainerProbeTag(ContainerTag):
+    tags = {"container_probe"}
+
+    def render(self, *args, caller=None, **kwargs):
+        return mark()
+
+
+def probe(*args, **kwargs):
+    return mark()
+
+
+# name -> template source
+BENCHMARKS = {
+    "standalone/args-0": "{{ mark() }}{% probe %}",
+    "standalone/args-5": "{{ mark() }}{% probe 1, 2, 3, d=4, e=5 %}",
+    "standalone/legacy-args-0": "{{ mark() }}{% legacy_probe %}",
+    "standalone/legacy-args-5": "{{ mark() }}{% legacy_probe 1, 2, 3, d=4, e=5 %}",
+    "container/args-0": "{{ mark() }}{% container_probe %}{% endcontainer_probe %}",
+    "baseline/function-args-0": "{{ mark() }}{{ probe() }}",
+    "baseline/function-args-5": "{{ mark() }}{{ probe(1, 2, 3, d=4, e=5) }}",
+}
+
+
+def create_environment():
+    env = Environment(extensions=[ProbeTag, LegacyProbeTag, ContainerProbeTag])
+    env.globals.update(mark=mark, probe=probe)
+    return env
+
+
+def run(names, repeat):
+    env = create_environment()
+    results = {}
+    for name in names:
+        template = env.from_string(BENCHMARKS[name])
+        for _ in range(100):
+            template.render()  # warm up
+
+        sizes = []
+        tracemalloc.start()
+        try:
+            for _ in range(repeat):
+                del marks[:]
+                template.render()
+                sizes.append(marks[1] - marks[0])
+        finally:
+            tracemalloc.stop()
+
+        results[name] = {
+            "min": min(sizes),
+            "max": max(sizes),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="*", help="run the benchmarks matching the pattern")
+    parser.add_argument("--repeat", type=int, default=20, help="number of repeats")
+    parser.add_argument("--json", metavar="PATH", help="write the results to a JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare with the results from a JSON file")
+    args = parser.parse_args(argv)
+
+    pattern = args.filter if any(char in args.filter for char in "*?[") else "*{}*".format(args.filter)
+    names = [name for name in BENCHMARKS if fnmatch.fnmatch(name, pattern)]
+    results = run(names, args.repeat)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+
+    for name, result in results.items():
+        line = "{:<40} {:6d} bytes per call".format(name, result["min"])
+        if name in baseline:
+            line += "  ({:+d})".format(result["min"] - baseline[name]["min"])
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({
+                "version": jinja2_simple_tags.__version__,
+                "jinja2": jinja2.__version__,
+                "python": platform.python_version(),
+                "results": results,
+            }, fp, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Micro-benchmarks for the tag call path.
+
+Every benchmark renders a template that calls a tag `CALLS` times in a loop and
+reports the time per tag call. The `baseline/*` benchmarks do the same work with
+plain Jinja2 constructs (global functions, `{% call %}`, `{% include %}`).
+
+The `sandbox/*` benchmarks render some of the templates in a `SandboxedEnvironment`,
+with the tags marked as trusted (`trusted-*`) and not.
+
+The `compile/*` benchmarks measure the cold-start cost instead: they compile
+a template with `CALLS` tag calls from source and report the time per call site.
+
+Usage:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --filter inclusion --json results.json
+    python benchmarks/run.py --compare results.json
+"""
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import jinja2
+from jinja2 import DictLoader, Environment
+from jinja2.sandbox import SandboxedEnvironment
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import jinja2_simple_tags  # noqa: E402
+from jinja2_simple_tags import ContainerTag, InclusionTag, StandaloneTag  # noqa: E402
+
+CALLS = 100
+
+TEMPLATES = {
+    "button/default.html": "<button>{{ text }}</button>",
+}
+
+
+class NoArgsTag(StandaloneTag):
+    tags = {"no_args"}
+
+    def render(self):
+        return "x"
+
+
+class FiveArgsTag(StandaloneTag):
+    tags = {"five_args"}
+
+    def render(self, a, b, c, d=None, e=None):
+        return "x"
+
+
+class WrapTag(ContainerTag):
+    tags = {"wrap"}
+
+    def render(self, caller=None):
+        return caller()
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button/default.html"
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+class CopyButtonTag(ButtonTag):
+    tags = {"copy_button"}
+    context_mode = "copy"
+
+
+class IsolatedButtonTag(ButtonTag):
+    tags = {"isolated_button"}
+    context_mode = "isolated"
+
+
+class InlineButtonTag(ButtonTag):
+    tags = {"inline_button"}
+    inline = True
+
+
+class FallbackButtonTag(ButtonTag):
+    tags = {"fallback_button"}
+    template_name = ("button/christmas.html", "button/default.html")
+
+
+class UncachedFallbackButtonTag(FallbackButtonTag):
+    tags = {"uncached_fallback_button"}
+    template_cache_size = 0
+
+
+class TrustedNoArgsTag(NoArgsTag):
+    tags = {"trusted_no_args"}
+    trusted = True
+
+
+class TrustedFiveArgsTag(FiveArgsTag):
+    tags = {"trusted_five_args"}
+    trusted = True
+
+
+class TrustedButtonTag(ButtonTag):
+    tags = {"trusted_button"}
+    trusted = True
+
+
+def five_args(a, b, c, d=None, e=None):
+    return "x"
+
+
+def wrap(caller=None):
+    return caller()
+
+
+def create_environment(environment_class=Environment):
+    env = environment_class(
+        loader=DictLoader(TEMPLATES),
+        extensions=[
+            NoArgsTag,
+            FiveArgsTag,
+            WrapTag,
+            ButtonTag,
+            CopyButtonTag,
+            IsolatedButtonTag,
+            InlineButtonTag,
+            FallbackButtonTag,
+            UncachedFallbackButtonTag,
+            TrustedNoArgsTag,
+            TrustedFiveArgsTag,
+            TrustedButtonTag,
+        ],
+        autoescape=True,
+        # templates don't change while the benchmarks run, as in production
+        auto_reload=False
+    )
+    env.globals.update(five_args=five_args, wrap=wrap)
+    return env
+
+
+def loop(body):
+    return "{% for _ in calls %}" + body + "{% endfor %}"
+
+
+SMALL_CONTEXT = {}
+LARGE_CONTEXT = {"var{}".format(index): index for index in range(1000)}
+LARGE_BODY = "<p>" + "lorem ipsum " * 1000 + "</p>"
+
+# name -> (template source, context)
+BENCHMARKS = {
+    "standalone/args-0": (loop("{% no_args %}"), SMALL_CONTEXT),
+    "standalone/args-5": (loop("{% five_args 1, 2, 3, d=4, e=5 %}"), SMALL_CONTEXT),
+    "standalone/assignment": (loop("{% five_args 1, 2, 3 as value %}{{ value }}"), SMALL_CONTEXT),
+    "baseline/function-args-5": (loop("{{ five_args(1, 2, 3, d=4, e=5) }}"), SMALL_CONTEXT),
+    "container/large-body": (loop("{% wrap %}" + LARGE_BODY + "{% endwrap %}"), SMALL_CONTEXT),
+    "baseline/call-block-large-body": (loop("{% call wrap() %}" + LARGE_BODY + "{% endcall %}"), SMALL_CONTEXT),
+    "inclusion/small-context": (loop("{% button 'OK' %}"), SMALL_CONTEXT),
+    "inclusion/large-context": (loop("{% button 'OK' %}"), LARGE_CONTEXT),
+    "inclusion/large-context-copy": (loop("{% copy_button 'OK' %}"), LARGE_CONTEXT),
+    "inclusion/large-context-isolated": (loop("{% isolated_button 'OK' %}"), LARGE_CONTEXT),
+    "inclusion/inline": (loop("{% inline_button 'OK' %}"), SMALL_CONTEXT),
+    "inclusion/inline-large-context": (loop("{% inline_button 'OK' %}"), LARGE_CONTEXT),
+    "inclusion/template-fallback": (loop("{% fallback_button 'OK' %}"), SMALL_CONTEXT),
+    "inclusion/template-fallback-uncached": (loop("{% uncached_fallback_button 'OK' %}"), SMALL_CONTEXT),
+    "baseline/include-small-context": (
+        loop("{% with text='OK' %}{% include 'button/default.html' %}{% endwith %}"),
+        SMALL_CONTEXT
+    ),
+    "baseline/include-large-context": (
+        loop("{% with text='OK' %}{% include 'button/default.html' %}{% endwith %}"),
+        LARGE_CONTEXT
+    ),
+}
+
+# name -> (template source, context), rendered in a sandboxed environment
+SANDBOX_BENCHMARKS = {
+    "sandbox/standalone-args-0": (loop("{% no_args %}"), SMALL_CONTEXT),
+    "sandbox/standalone-args-5": (loop("{% five_args 1, 2, 3, d=4, e=5 %}"), SMALL_CONTEXT),
+    "sandbox/trusted-standalone-args-0": (loop("{% trusted_no_args %}"), SMALL_CONTEXT),
+    "sandbox/trusted-standalone-args-5": (loop("{% trusted_five_args 1, 2, 3, d=4, e=5 %}"), SMALL_CONTEXT),
+    "sandbox/inclusion": (loop("{% button 'OK' %}"), SMALL_CONTEXT),
+    "sandbox/trusted-inclusion": (loop("{% trusted_button 'OK' %}"), SMALL_CONTEXT),
+    "sandbox/baseline-function-args-5": (loop("{{ five_args(1, 2, 3, d=4, e=5) }}"), SMALL_CONTEXT),
+}
+
+# name -> template source
+COMPILE_BENCHMARKS = {
+    "compile/standalone-args-0": "{% no_args %}\n" * CALLS,
+    "compile/standalone-args-5": "{% five_args 1, 2, 3, d=4, e=5 %}\n" * CALLS,
+    "compile/standalone-assignment": "{% five_args 1, 2, 3 as value %}{{ value }}\n" * CALLS,
+    "compile/container": "{% wrap %}text{% endwrap %}\n" * CALLS,
+    "compile/inclusion": "{% button 'OK' %}\n" * CALLS,
+    "compile/inclusion-inline": "{% inline_button 'OK' %}\n" * CALLS,
+    "compile/baseline-function-args-5": "{{ five_args(1, 2, 3, d=4, e=5) }}\n" * CALLS,
+}
+
+
+def measure(render, number, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            render()
+        timings.append((time.perf_counter() - start) / (number * CALLS))
+    return timings
+
+
+def run(names, number, repeat):
+    env = create_environment()
+    sandboxed_env = create_environment(SandboxedEnvironment)
+    results = {}
+    for name in names:
+        if name in COMPILE_BENCHMARKS:
+            source = COMPILE_BENCHMARKS[name]
+            timings = measure(lambda: env.compile(source, name=name), max(number // 10, 1), repeat)
+            results[name] = {
+                "min": min(timings),
+                "mean": sum(timings) / len(timings),
+            }
+            continue
+
+        if name in SANDBOX_BENCHMARKS:
+            source, context = SANDBOX_BENCHMARKS[name]
+            template = sandboxed_env.from_string(source)
+        else:
+            source, context = BENCHMARKS[name]
+            template = env.from_string(source)
+        context = dict(context, calls=range(CALLS))
+        template.render(context)  # warm up
+
+        timings = measure(lambda: template.render(context), number, repeat)
+        results[name] = {
+            "min": min(timings),
+            "mean": sum(timings) / len(timings),
+        }
+    return results
+
+
+def format_time(seconds):
+    return "{:10.3f} us".format(seconds * 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="*", help="run the benchmarks matching the pattern")
+    parser.add_argument("--number", type=int, default=50, help="renders per repeat")
+    parser.add_argument("--repeat", type=int, default=5, help="number of repeats")
+    parser.add_argument("--json", metavar="PATH", help="write the results to a JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare with the results from a JSON file")
+    args = parser.parse_args(argv)
+
+    pattern = args.filter if any(char in args.filter for char in "*?[") else "*{}*".format(args.filter)
+    names = [
+        name
+        for name in list(BENCHMARKS) + list(SANDBOX_BENCHMARKS) + list(COMPILE_BENCHMARKS)
+        if fnmatch.fnmatch(name, pattern)
+    ]
+    results = run(names, args.number, args.repeat)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+
+    for name, result in results.items():
+        line = "{:<40} {} per call".format(name, format_time(result["min"]))
+        if name in baseline:
+            change = result["min"] / baseline[name]["min"] - 1
+            line += "  ({:+.1%})".format(change)
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({
+                "version": jinja2_simple_tags.__version__,
+                "jinja2": jinja2.__version__,
+                "python": platform.python_version(),
+                "calls": CALLS,
+                "results": results,
+            }, fp, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,1022 @@
+import hashlib
+import inspect
+import itertools
+import os
+import re
+import sys
+import threading
+import time
 import warnings
-from typing import Any, ClassVar, Dict, List, Tuple
+import weakref
+from collections import ChainMap, OrderedDict, deque
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from jinja2 import nodes
+from jinja2 import Environment, Template, nodes
 from jinja2.ext import Extension
 from jinja2.lexer import describe_token
 from jinja2.parser import Parser
 from jinja2.runtime import Context
+from jinja2.utils import missing
+from markupsafe import Markup, escape
 
-__all__ = ["StandaloneTag", "ContainerTag", "InclusionTag"]
+# Imported where they are used, so that importing the module doesn't pull
+# in the modules only needed by async environments, deferred rendering,
+# logging and bulk rendering.
+if TYPE_CHECKING:
+    import asyncio
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+__all__ = [
+    "StandaloneTag", "ContainerTag", "InclusionTag", "CacheTag",
+    "DeferredTemplate", "LazyOutput", "LazyMarkup", "MemoryCache", "TagStats", "SlowCallLogger",
+    "TagProfiler", "TagIndex", "TagUsage", "build_index", "render_many", "warm_up"
+]
 __version__ = "0.6.1"
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python 3.6
+    ContextVar = None  # type: ignore
+
+
+class CallFrame:
+    """
+    State of a single tag invocation.
+
+    Jinja2 creates one extension instance per `Environment`, so the call state
+    can't be stored on the instance itself: concurrent renders would overwrite
+    each other. Instead, a new frame is created for every call and bound to the
+    current thread or asyncio task for the duration of `render()`.
+
+    `included` is set by `InclusionTag` to the name of the rendered template.
+    """
+    __slots__ = ("context", "site", "cache_hit", "included")
+
+    def __init__(self, context: Context, site: Tuple[Optional[str], int, str]):
+        # The site is the constant tuple (template, lineno, tag_name) stored
+        # in the compiled template, so it is shared rather than unpacked.
+        self.context = context
+        self.site = site
+        self.cache_hit = None  # type: Optional[bool]
+        self.included = None  # type: Optional[str]
+
+    @property
+    def template(self) -> Optional[str]:
+        return self.site[0]
+
+    @property
+    def lineno(self) -> int:
+        return self.site[1]
+
+    @property
+    def tag_name(self) -> str:
+        return self.site[2]
+
+    def __repr__(self):
+        return "<{} {}:{} - {}>".format(
+            type(self).__name__,
+            self.template,
+            self.lineno,
+            self.tag_name
+        )
+
+
+def _current_task():
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        # no task can be running before asyncio is imported
+        return None
+    loop = asyncio.events._get_running_loop()
+    if loop is None:
+        return None
+    current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+    return current_task(loop)
+
+
+class _TaskLocalVar:
+    """
+    Minimal `ContextVar` replacement for Python 3.6. The value is bound
+    to the current asyncio task, or to the current thread outside of tasks.
+    Unlike `ContextVar`, new tasks don't inherit the value.
+    """
+    def __init__(self):
+        self._threads = threading.local()
+        self._tasks = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+    def get(self, default=None):
+        task = _current_task()
+        if task is None:
+            return getattr(self._threads, "value", default)
+        return self._tasks.get(task, default)
+
+    def set(self, value):
+        task = _current_task()
+        if task is None:
+            token = getattr(self._threads, "value", None)
+            self._threads.value = value
+        else:
+            token = self._tasks.get(task)
+            self._tasks[task] = value
+        return token
+
+    def reset(self, token):
+        self.set(token)
+
+
+_current_frame: "ContextVar[Optional[CallFrame]]"
+_current_scheduler: "ContextVar[Optional[_RenderScheduler]]"
+_current_index: "ContextVar[Optional[TagIndex]]"
+
+if ContextVar is not None:
+    _current_frame = ContextVar("jinja2_simple_tags_frame", default=None)
+    _current_scheduler = ContextVar("jinja2_simple_tags_scheduler", default=None)
+    _current_index = ContextVar("jinja2_simple_tags_index", default=None)
+else:
+    _current_frame = _TaskLocalVar()  # type: ignore
+    _current_scheduler = _TaskLocalVar()  # type: ignore
+    _current_index = _TaskLocalVar()  # type: ignore
+
+
+class MemoryCache:
+    """
+    Thread-safe in-memory LRU cache with optional expiration of entries.
+
+    `max_size` limits the number of entries (`None` means unbounded),
+    `timeout` is the default lifetime of an entry in seconds (`None` means forever).
+    """
+
+    def __init__(self, max_size: Optional[int] = 128, timeout: Optional[float] = None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout: Optional[float] = None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TagStats:
+    """
+    Tag observer which collects the number of calls and the latency
+    percentiles for each call site.
+
+    `max_samples` limits the number of the latest durations kept per call site
+    for the percentile calculation.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._sites = {}  # type: Dict[Tuple[Optional[str], int, str], Dict[str, Any]]
+        self._lock = threading.Lock()
+
+    def __call__(self, tag_name, template, lineno, duration, cache_hit):
+        key = (template, lineno, tag_name)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = {
+                    "calls": 0,
+                    "total": 0.0,
+                    "cache_hits": 0,
+                    "samples": deque(maxlen=self.max_samples),
+                }
+            site["calls"] += 1
+            site["total"] += duration
+            site["samples"].append(duration)
+            if cache_hit:
+                site["cache_hits"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Return the statistics of every call site, the slowest ones first.
+        """
+        with self._lock:
+            sites = [
+                (key, dict(site, samples=sorted(site["samples"])))
+                for key, site in self._sites.items()
+            ]
+
+        report = []
+        for (template, lineno, tag_name), site in sites:
+            samples = site["samples"]
+            report.append({
+                "tag_name": tag_name,
+                "template": template,
+                "lineno": lineno,
+                "calls": site["calls"],
+                "cache_hits": site["cache_hits"],
+                "total": site["total"],
+                "mean": site["total"] / site["calls"],
+                "p50": self._percentile(samples, 50),
+                "p90": self._percentile(samples, 90),
+                "p99": self._percentile(samples, 99),
+                "max": samples[-1],
+            })
+
+        report.sort(key=lambda item: item["total"], reverse=True)
+        return report
+
+    @staticmethod
+    def _percentile(samples, percent):
+        index = max(0, -(-len(samples) * percent // 100) - 1)
+        return samples[index]
+
+
+class SlowCallLogger:
+    """
+    Tag observer which logs the calls that took at least `threshold` seconds.
+    """
+
+    def __init__(self, threshold: float, logger: Optional["logging.Logger"] = None):
+        import logging
+
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger("jinja2_simple_tags")
+
+    def __call__(self, tag_name, template, lineno, duration, cache_hit):
+        if duration >= self.threshold:
+            self.logger.warning(
+                "Slow tag call: %r at %s:%s took %.3fs",
+                tag_name,
+                template,
+                lineno,
+                duration
+            )
+
+
+class TagProfiler:
+    """
+    Tag observer which builds a tree of the tag calls. Every node is a call
+    site, and its children are the call sites within the template rendered
+    by it (like the template of an `InclusionTag`).
+    """
+
+    def __init__(self):
+        self._roots = {}  # type: Dict[Tuple[Optional[str], int, str], Dict[str, Any]]
+        self._active = {}  # type: Dict[CallFrame, Dict[str, Any]]
+        self._lock = threading.Lock()
+
+    def enter(self, frame: CallFrame, parent: Optional[CallFrame]):
+        with self._lock:
+            parent_node = self._active.get(parent) if parent is not None else None
+            children = parent_node["children"] if parent_node is not None else self._roots
+            node = children.get(frame.site)
+            if node is None:
+                node = children[frame.site] = {
+                    "calls": 0,
+                    "total": 0.0,
+                    "size": 0,
+                    "included": None,
+                    "children": {},
+                }
+            self._active[frame] = node
+
+    def leave(self, frame: CallFrame, duration: float, size: Optional[int]):
+        with self._lock:
+            node = self._active.pop(frame, None)
+            if node is None:
+                return
+
+            node["calls"] += 1
+            node["total"] += duration
+            node["size"] += size or 0
+            included = frame.included
+            if included is not None:
+                node["included"] = included
+
+    def reset(self):
+        with self._lock:
+            self._roots.clear()
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Return the call tree, the slowest call sites first. The self time of
+        a call site is its total time minus the total time of its children.
+        The result can be serialized to JSON.
+        """
+        with self._lock:
+            return self._build_report(self._roots)
+
+    def _build_report(self, nodes_):
+        report = []
+        for (template, lineno, tag_name), node in nodes_.items():
+            children = self._build_report(node["children"])
+            children_total = sum(child["total"] for child in children)
+            report.append({
+                "tag_name": tag_name,
+                "template": template,
+                "lineno": lineno,
+                "included": node["included"],
+                "calls": node["calls"],
+                "total": node["total"],
+                "self": max(node["total"] - children_total, 0.0),
+                "size": node["size"],
+                "children": children,
+            })
+
+        report.sort(key=lambda item: item["total"], reverse=True)
+        return report
+
+    def collapsed(self) -> str:
+        """
+        Return the call tree in the collapsed stack format, which is read by
+        flamegraph.pl, speedscope and similar tools. Every line is a path of
+        call sites followed by its self time in microseconds.
+        """
+        lines = []
+
+        def walk(items, stack):
+            for item in items:
+                name = "{} ({}:{})".format(item["tag_name"], item["template"] or "<template>", item["lineno"])
+                path = stack + [name.replace(";", ",")]
+                lines.append("{} {}".format(";".join(path), round(item["self"] * 1e6)))
+                walk(item["children"], path)
+
+        walk(self.report(), [])
+        return "\n".join(lines)
+
+
+class _KeyLocks:
+    """
+    Reentrant locks for individual keys. A lock is discarded as soon as
+    no thread holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks = {}  # type: Dict[Any, list]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+_missing = object()
+
+# Types of the values the default cache key of a tag can be built from.
+_KEY_TYPES = (str, int, float, bool, type(None))
+
+# The placeholders of deferred calls: "\x02jst:<nonce>:<index>\x03". The nonce is
+# random for every render, so that values that look like placeholders are left as is.
+_PLACEHOLDER_RE = re.compile("\x02jst:([0-9a-f]+):(\\d+)\x03")
+
+# End tokens of the blocks whose output is written out as is. The output of the
+# other blocks (filter blocks, block assignments, macros, call blocks and the bodies
+# of container tags) is processed by the template before it is written out.
+_PASS_THROUGH_END_TOKENS = frozenset((
+    "name:elif", "name:else", "name:endif", "name:endfor",
+    "name:endblock", "name:endwith", "name:endautoescape"
+))
+
+# Keywords with the call metadata that `parse()` adds to the arguments of a tag.
+_METADATA_KEYS = frozenset(("_context", "_template", "_lineno", "_tag_name"))
+
+# Render methods called by `invoke_observed()` in place of the `invoke*()` methods.
+_OBSERVED_METHODS = {
+    "invoke": "render",
+    "invoke_cached": "render_cached",
+    "invoke_stream": "render_stream",
+    "invoke_body_stream": "render_body_stream",
+    "invoke_inline": "render_inline",
+}
+
+# Render methods that return an iterator over the output chunks.
+_STREAM_METHODS = frozenset(("render_stream", "render_body_stream"))
+
+
+def _trusted_call(identifier: str, name: str):
+    """
+    Create the function that the calls of a trusted tag compile to in
+    sandboxed environments, in place of `environment.call()`.
+    """
+    def call(context, *args, **kwargs):
+        return getattr(context.environment.extensions[identifier], name)(context, *args, **kwargs)
+    return call
+
+
+def _trusted_filter_name(identifier: str, name: str) -> str:
+    # A filter name that can't be written in a template.
+    return "{}:{}".format(identifier, name)
+
+
+def _parse_argument_spec(spec, implicit_kwargs=()) -> inspect.Signature:
+    """
+    Build a signature from the `arguments` spec of a tag.
+
+    Every entry is a parameter name, optionally marked the same way as in
+    a function definition: "name=" (optional), "*" (the following names are
+    keyword-only), "*name" (extra positional) and "**name" (extra keyword).
+    """
+    parameters = []
+    kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+    for entry in spec:
+        name = entry.rstrip("=")
+        default = None if name != entry else inspect.Parameter.empty
+        if name == "*":
+            kind = inspect.Parameter.KEYWORD_ONLY
+            continue
+        elif name.startswith("**"):
+            parameters.append(inspect.Parameter(name[2:], inspect.Parameter.VAR_KEYWORD))
+            continue
+        elif name.startswith("*"):
+            parameters.append(inspect.Parameter(name[1:], inspect.Parameter.VAR_POSITIONAL))
+            kind = inspect.Parameter.KEYWORD_ONLY
+            continue
+        parameters.append(inspect.Parameter(name, kind, default=default))
+
+    names = {parameter.name for parameter in parameters}
+    if not any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters):
+        for name in implicit_kwargs:
+            if name not in names:
+                parameters.append(inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=None))
+
+    # keep the var-keyword parameter last after adding the implicit ones
+    parameters.sort(key=lambda parameter: parameter.kind == inspect.Parameter.VAR_KEYWORD)
+    try:
+        return inspect.Signature(parameters)
+    except ValueError as exc:
+        raise ValueError("Invalid argument spec {!r}: {}".format(spec, exc)) from None
+
+
+class _DeferredCall:
+    __slots__ = ("extension", "frame", "method", "args", "kwargs", "key", "autoescape")
+
+    def __init__(self, extension, frame, method, args, kwargs, key):
+        self.extension = extension
+        self.frame = frame
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.autoescape = frame.context.eval_ctx.autoescape
+
+    def finish(self, value) -> str:
+        # apply the escaping that the template would have applied to the output
+        if self.autoescape and not self.extension.safe_output:
+            value = escape(value)
+        return str(value)
+
+    def run(self) -> str:
+        return self.finish(self.extension.call_in_frame(self.frame, self.method, self.args, self.kwargs))
+
+    async def run_async(self) -> str:
+        return self.finish(
+            await self.extension.call_in_frame_async(self.frame, self.method, self.args, self.kwargs)
+        )
+
+
+# Set in the threads that render deferred tags.
+_worker_state = threading.local()
+
+# Set while the template of an inline tag is parsed in place of a captured call.
+_parse_state = threading.local()
+
+
+@contextmanager
+def _in_place():
+    """
+    Disable the deferral of tag calls, so that batched and deferred tags
+    are rendered in place rather than replaced with placeholders.
+    """
+    token = _current_scheduler.set(None)
+    try:
+        yield
+    finally:
+        _current_scheduler.reset(token)
+
+
+class _RenderScheduler:
+    """
+    Collects the tag calls deferred during the rendering of a `DeferredTemplate`.
+    Once the template is rendered, the keys of the batched tags are loaded with
+    a single `load_many()` call per tag, the deferred calls are rendered and
+    their placeholders in the output are replaced with the results.
+
+    The calls of the tags with `deferred = True` are rendered concurrently:
+    in the `executor` thread pool or, in async environments, with `asyncio.gather()`.
+    """
+
+    def __init__(self, get_executor=None):
+        self.get_executor = get_executor
+        self.pending = []  # type: List[Tuple[int, _DeferredCall]]
+        self.results = {}  # type: Dict[int, str]
+        self.loaded = {}  # type: Dict[StandaloneTag, Dict[Any, Any]]
+        self.nonce = os.urandom(8).hex()
+        self._counter = itertools.count()
+
+    def defer(self, call: _DeferredCall) -> str:
+        index = next(self._counter)
+        self.pending.append((index, call))
+        return "\x02jst:{}:{}\x03".format(self.nonce, index)
+
+    def get_batches(self, calls) -> "Dict[StandaloneTag, List[Any]]":
+        batches = {}  # type: Dict[StandaloneTag, List[Any]]
+        for index, call in calls:
+            if call.key is None:
+                continue
+            loaded = self.loaded.get(call.extension, ())
+            keys = batches.setdefault(call.extension, [])
+            if call.key not in loaded and call.key not in keys:
+                keys.append(call.key)
+        return batches
+
+    def resolve(self, output: str) -> str:
+        # rendering of the deferred calls can defer new calls
+        while self.pending:
+            calls, self.pending = self.pending, []
+            for extension, keys in self.get_batches(calls).items():
+                if keys:
+                    self.loaded.setdefault(extension, {}).update(extension.load_many(keys))
+            self.run(calls)
+        return self.substitute(output)
+
+    def run(self, calls):
+        parallel = [
+            (index, call)
+            for index, call in calls
+            if call.extension.deferred
+        ]
+        if len(parallel) < 2 or self.get_executor is None or getattr(_worker_state, "active", False):
+            # Deferred tags rendered by a worker thread are rendered sequentially,
+            # so that the nested renders don't wait for the threads of the same pool.
+            parallel = []
+
+        executor = self.get_executor() if parallel else None
+        futures = [
+            (index, executor.submit(self.run_in_worker, call))
+            for index, call in parallel
+        ]
+
+        parallel_indexes = {index for index, call in parallel}
+        for index, call in calls:
+            if index not in parallel_indexes:
+                self.results[index] = call.run()
+
+        for index, future in futures:
+            self.results[index] = future.result()
+
+    def run_in_worker(self, call: _DeferredCall) -> str:
+        _worker_state.active = True
+        token = _current_scheduler.set(self)
+        try:
+            return call.run()
+        finally:
+            _current_scheduler.reset(token)
+            _worker_state.active = False
+
+    async def resolve_async(self, output: str) -> str:
+        import asyncio
+
+        while self.pending:
+            calls, self.pending = self.pending, []
+            for extension, keys in self.get_batches(calls).items():
+                if keys:
+                    values = extension.load_many(keys)
+                    if inspect.isawaitable(values):
+                        values = await values
+                    self.loaded.setdefault(extension, {}).update(values)
+            results = await asyncio.gather(*[
+                call.run_async()
+                for index, call in calls
+                if call.extension.deferred
+            ])
+            parallel = iter(results)
+            for index, call in calls:
+                if call.extension.deferred:
+                    self.results[index] = next(parallel)
+                else:
+                    self.results[index] = await call.run_async()
+        return self.substitute(output)
+
+    def substitute(self, output: str) -> str:
+        if not self.results:
+            # nothing was deferred
+            return output
+
+        output = _PLACEHOLDER_RE.sub(self.replace_placeholder, output)
+        # A placeholder that is still there was changed by the template (for example,
+        # by a filter block around an `{% include %}`), so its call was lost.
+        if re.search(re.escape("\x02jst:{}:".format(self.nonce)), output, re.IGNORECASE):
+            raise RuntimeError(
+                "The output of a deferred tag call was processed by the template "
+                "before the call was rendered. This happens when the tag is rendered "
+                "by an `{% include %}` or a block reference inside a filter block "
+                "or a block assignment; the tag should not be deferred there."
+            )
+        return output
+
+    def replace_placeholder(self, match) -> str:
+        nonce, index = match.groups()
+        result = self.results.get(int(index)) if nonce == self.nonce else None
+        if result is None:
+            # a value that looks like a placeholder, or one of another render
+            return match.group(0)
+        return self.substitute(result)
+
+
+class DeferredTemplate(Template):
+    """
+    Template class that renders batched and deferred tags at the end
+    of the rendering:
+
+        env.template_class = DeferredTemplate
+
+    The deferral applies to `render()` and `render_async()`. The other ways
+    of rendering a template (`generate()`, `stream()`) render the tags
+    in place.
+
+    Deferred tags are rendered in the thread pool returned by `get_executor()`.
+    By default, it is a pool with up to `max_workers` threads shared by all
+    the templates.
+    """
+    max_workers: ClassVar[Optional[int]] = 8
+    executor: ClassVar[Optional["ThreadPoolExecutor"]] = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> "ThreadPoolExecutor":
+        from concurrent.futures import ThreadPoolExecutor
+
+        if cls.executor is None:
+            with cls._executor_lock:
+                if cls.executor is None:
+                    cls.executor = ThreadPoolExecutor(
+                        max_workers=cls.max_workers,
+                        thread_name_prefix="jinja2_simple_tags"
+                    )
+        return cls.executor
+
+    def render(self, *args, **kwargs):
+        if self.environment.is_async:
+            return super().render(*args, **kwargs)
+
+        scheduler = _RenderScheduler(self.get_executor)
+        token = _current_scheduler.set(scheduler)
+        try:
+            return scheduler.resolve(super().render(*args, **kwargs))
+        finally:
+            _current_scheduler.reset(token)
+
+    async def render_async(self, *args, **kwargs):
+        scheduler = _RenderScheduler()
+        token = _current_scheduler.set(scheduler)
+        try:
+            return await scheduler.resolve_async(await super().render_async(*args, **kwargs))
+        finally:
+            _current_scheduler.reset(token)
+
+
+def _observe_stream(extension, frame, stream, duration):
+    """
+    Pass through the chunks of a streaming tag, measuring the time spent on
+    producing them. The frame is bound while each chunk is produced, so that
+    nested tag calls are attributed to it. The observer is notified when
+    the stream is exhausted, fails or is closed.
+    """
+    iterator = iter(stream)
+    size = 0
+    try:
+        while True:
+            token = _current_frame.set(frame)
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                duration += time.perf_counter() - start
+                _current_frame.reset(token)
+            size += len(chunk)
+            yield chunk
+    finally:
+        extension.notify_observer(frame, duration, size)
+
+
+async def _observe_stream_async(extension, frame, stream, duration):
+    iterator = stream.__aiter__()
+    size = 0
+    try:
+        while True:
+            token = _current_frame.set(frame)
+            start = time.perf_counter()
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                duration += time.perf_counter() - start
+                _current_frame.reset(token)
+            size += len(chunk)
+            yield chunk
+    finally:
+        extension.notify_observer(frame, duration, size)
+
+
+def _stream_in_place(stream):
+    """
+    Pass through the chunks of a generator, disabling the deferral of tag calls
+    while each chunk is produced.
+    """
+    iterator = iter(stream)
+    while True:
+        with _in_place():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+        yield chunk
+
+
+def _stream_in_frame(frame, stream):
+    """
+    Pass through the chunks of a generator, binding the call frame while
+    each chunk is produced.
+    """
+    iterator = iter(stream)
+    while True:
+        token = _current_frame.set(frame)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            _current_frame.reset(token)
+        yield chunk
+
+
+async def _stream_in_frame_async(frame, stream):
+    iterator = stream.__aiter__()
+    while True:
+        token = _current_frame.set(frame)
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+        finally:
+            _current_frame.reset(token)
+        yield chunk
+
+
+class LazyOutput:
+    """
+    The output of a lazy tag assigned to a variable with `as`.
+
+    The tag is rendered when the value is first used as a string, and
+    the result is kept for the later uses. Comparisons, membership tests,
+    indexing, concatenation and attribute lookups (like `value.upper()`)
+    are applied to the rendered output. Iterating over a value that
+    hasn't been rendered yet yields the output chunk by chunk without
+    keeping it, rendering the tag again on every iteration.
+
+    The output is escaped by autoescaping, unless the value is a `LazyMarkup`.
+    """
+    __slots__ = ("_render", "_stream", "_value")
+
+    def __init__(self, render, stream=None):
+        self._render = render
+        self._stream = stream
+        self._value = _missing
+
+    def render(self):
+        if self._value is _missing:
+            self._value = self._render()
+            # release the context of the call
+            self._render = self._stream = None
+        return self._value
+
+    def __iter__(self):
+        if self._value is not _missing:
+            return iter([self._value])
+        if self._stream is not None:
+            return iter(self._stream())
+        return iter([self._render()])
+
+    def __str__(self):
+        return str(self.render())
+
+    def __bool__(self):
+        return bool(self.render())
+
+    def __len__(self):
+        return len(self.render())
+
+    def __eq__(self, other):
+        return self.render() == other
+
+    def __lt__(self, other):
+        return self.render() < other
+
+    def __le__(self, other):
+        return self.render() <= other
+
+    def __gt__(self, other):
+        return self.render() > other
+
+    def __ge__(self, other):
+        return self.render() >= other
+
+    def __hash__(self):
+        return hash(self.render())
+
+    def __contains__(self, item):
+        return item in self.render()
+
+    def __getitem__(self, key):
+        return self.render()[key]
+
+    def __add__(self, other):
+        return self.render() + other
+
+    def __radd__(self, other):
+        return other + self.render()
+
+    def __getattr__(self, name):
+        # only called for the names that are not defined by the class
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.render(), name)
+
+    def __repr__(self):
+        return "<{} {}>".format(
+            type(self).__name__,
+            "pending" if self._value is _missing else "rendered"
+        )
+
+
+class LazyMarkup(LazyOutput):
+    """
+    The lazy output of a tag whose output is safe, which is not escaped
+    by autoescaping.
+    """
+    __slots__ = ()
+
+    def __html__(self):
+        return escape(self.render())
+
+
+def _is_key_value(value) -> bool:
+    if isinstance(value, tuple):
+        return all(_is_key_value(item) for item in value)
+    return isinstance(value, _KEY_TYPES)
+
+
+def _copy_nodes(node: nodes.Node, lineno: int):
+    """
+    Copy a node tree, setting the line number of every node. Unlike `copy.deepcopy()`,
+    the copy shares the environment and the constant values with the original.
+    """
+    clone = object.__new__(type(node))
+    for field in node.fields:
+        value = getattr(node, field)
+        if isinstance(value, nodes.Node):
+            value = _copy_nodes(value, lineno)
+        elif isinstance(value, list):
+            value = [
+                _copy_nodes(item, lineno) if isinstance(item, nodes.Node) else item
+                for item in value
+            ]
+        setattr(clone, field, value)
+    clone.environment = getattr(node, "environment", None)
+    clone.lineno = lineno
+    return clone
+
+
+def _join_output(chunks, autoescape: bool) -> str:
+    """
+    Concatenate output chunks the way a Jinja2 assignment block does.
+    """
+    if autoescape:
+        return Markup("").join(chunks)
+    return "".join([str(chunk) for chunk in chunks])
+
 
 class BaseTemplateTag(Extension):
+    arguments: ClassVar[Optional[Tuple[str, ...]]] = None
+    signature_methods: ClassVar[Tuple[str, ...]] = ("render",)
+    implicit_kwargs: ClassVar[Tuple[str, ...]] = ()
+    lazy: ClassVar[bool] = False
+    trusted: ClassVar[bool] = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Warn once, when the class is defined, rather than on every compile.
+        if callable(cls.__dict__.get("output")):
+            warnings.warn(
+                "The \"output\" method of the \"BaseTemplateTag\" class is deprecated "
+                "and will be removed in a future version. Please use the \"create_node\" "
+                "method instead.",
+                DeprecationWarning,
+                stacklevel=2
+            )
+
     def __init__(self, environment):
         super().__init__(environment)
-        self.context = None
-        self.template = None
-        self.lineno = None
-        self.tag_name = None
+        environment.extend(tag_observer=None)
+        self._signatures = None  # type: Optional[List[inspect.Signature]]
+        self._argument_errors = {}  # type: Dict[Tuple[int, Tuple[str, ...]], Optional[str]]
+
+        if self.is_trusted():
+            # The calls are compiled to filters, which the sandbox doesn't check.
+            # They are registered upfront for templates loaded from the bytecode cache.
+            for name in dir(type(self)):
+                if name.startswith("invoke"):
+                    filter_name = _trusted_filter_name(self.identifier, name)
+                    environment.filters[filter_name] = _trusted_call(self.identifier, name)
 
-    def parse(self, parser: Parser) -> nodes.Node:
+    @property
+    def frame(self) -> Optional[CallFrame]:
+        """
+        The frame of the tag call being rendered in the current thread.
+        """
+        return _current_frame.get()
+
+    @property
+    def context(self) -> Optional[Context]:
+        frame = _current_frame.get()
+        return frame.context if frame is not None else None
+
+    @property
+    def template(self) -> Optional[str]:
+        frame = _current_frame.get()
+        return frame.site[0] if frame is not None else None
+
+    @property
+    def lineno(self) -> Optional[int]:
+        frame = _current_frame.get()
+        return frame.site[1] if frame is not None else None
+
+    @property
+    def tag_name(self) -> Optional[str]:
+        frame = _current_frame.get()
+        return frame.site[2] if frame is not None else None
+
+    def parse(self, parser: Parser) -> Union[nodes.Node, List[nodes.Node]]:
         lineno = parser.stream.current.lineno
         tag_name = parser.stream.current.value
         additional_params = [
@@ -29,19 +1026,29 @@ class BaseTemplateTag(Extension):
             nodes.Keyword("_tag_name", nodes.Const(tag_name)),
         ]
 
+        if not self.environment.is_async and self.is_async_tag():
+            parser.fail(
+                "Tag {!r} is asynchronous and requires an environment "
+                "with enable_async=True".format(tag_name),
+                lineno
+            )
+
         self.init_parser(parser)
         args, kwargs, options = self.parse_args(parser)
+        error = self.check_arguments(args, kwargs)
+        if error is not None:
+            parser.fail("Invalid arguments for tag {!r}: {}".format(tag_name, error), lineno)
+
+        index = _current_index.get()
+        if index is not None:
+            index.record(self, parser.name, lineno, tag_name, args, kwargs)
+
         kwargs.extend(additional_params)
         options.setdefault("tag_name", tag_name)
+        options.setdefault("captured", self.is_captured(parser))
 
         if hasattr(self, "output") and callable(self.output):
-            warnings.warn(
-                "The \"output\" method of the \"BaseTemplateTag\" class is deprecated "
-                "and will be removed in a future version. Please use the \"create_node\" "
-                "method instead.",
-                DeprecationWarning
-            )
-            call_node = self.call_method("render_wrapper", args, kwargs, lineno=lineno)
+            call_node = self.call_invoke(args, kwargs, lineno=lineno)
             return self.output(parser, call_node, lineno=lineno, **options)
 
         return self.create_node(
@@ -52,6 +1059,19 @@ class BaseTemplateTag(Extension):
             **options
         )
 
+    def is_captured(self, parser: Parser) -> bool:
+        """
+        Return True if the tag being parsed is inside a block whose output is
+        processed by the template rather than written out: a filter block,
+        a block assignment, a macro, a call block or the body of a container tag.
+        """
+        if getattr(_parse_state, "captured", False):
+            return True
+        return any(
+            not _PASS_THROUGH_END_TOKENS.issuperset(end_tokens)
+            for end_tokens in getattr(parser, "_end_token_stack", ())
+        )
+
     def init_parser(self, parser: Parser):
         parser.stream.skip(1)  # skip tag name
 
@@ -64,43 +1084,40 @@ class BaseTemplateTag(Extension):
         options = {
             "target": None
         }
+        stream = parser.stream
         require_comma = False
-        arguments_finished = False
 
-        while parser.stream.current.type != "block_end":
-            if parser.stream.current.test("name:as"):
-                parser.stream.skip(1)
-                options["target"] = parser.stream.expect("name").value
-                arguments_finished = True
-
-            if arguments_finished:
-                if not parser.stream.current.test("block_end"):
+        # Tokens are classified by comparing their type and value directly;
+        # the stream is only peeked when a name might start a keyword argument.
+        while stream.current.type != "block_end":
+            token = stream.current
+            if token.type == "name" and token.value == "as":
+                next(stream)
+                options["target"] = stream.expect("name").value
+                if stream.current.type != "block_end":
                     parser.fail(
                         "expected token 'block_end', got {!r}".format(
-                            describe_token(parser.stream.current)
+                            describe_token(stream.current)
                         ),
-                        parser.stream.current.lineno
+                        stream.current.lineno
                     )
                 break
 
             if require_comma:
-                parser.stream.expect("comma")
+                stream.expect("comma")
 
                 # support for trailing comma
-                if parser.stream.current.type == "block_end":
+                if stream.current.type == "block_end":
                     break
+                token = stream.current
 
-            if (
-                parser.stream.current.type == "name"
-                and parser.stream.look().type == "assign"
-            ):
-                key = parser.stream.current.value
-                parser.stream.skip(2)
+            if token.type == "name" and stream.look().type == "assign":
+                stream.skip(2)
                 value = parser.parse_expression()
-                kwargs.append(nodes.Keyword(key, value, lineno=value.lineno))
+                kwargs.append(nodes.Keyword(token.value, value, lineno=value.lineno))
             else:
                 if kwargs:
-                    parser.fail("Invalid argument syntax", parser.stream.current.lineno)
+                    parser.fail("Invalid argument syntax", token.lineno)
                 args.append(parser.parse_expression())
 
             require_comma = True
@@ -115,93 +1132,1377 @@ class BaseTemplateTag(Extension):
         *,
         lineno: int,
         **options
-    ) -> nodes.Node:
+    ) -> Union[nodes.Node, List[nodes.Node]]:
         raise NotImplementedError
 
-
-class StandaloneTag(BaseTemplateTag):
-    safe_output: ClassVar[bool] = False
-
-    def create_node(
+    def check_arguments(
         self,
-        parser: Parser,
         args: List[nodes.Expr],
-        kwargs: List[nodes.Keyword],
-        *,
-        lineno: int,
-        **options
-    ) -> nodes.Node:
-        call_node = self.call_method("render_wrapper", args, kwargs, lineno=lineno)
-        if self.safe_output:
-            call_node = nodes.MarkSafeIfAutoescape(call_node, lineno=lineno)
+        kwargs: List[nodes.Keyword]
+    ) -> Optional[str]:
+        """
+        Check the arguments of a tag call against the `arguments` spec or the
+        signatures of the methods listed in `signature_methods`.
+        Returns an error message or None.
 
-        if options["target"]:
-            target_node = nodes.Name(options["target"], "store", lineno=lineno)
-            return nodes.Assign(target_node, call_node, lineno=lineno)
+        The outcome only depends on the number of positional arguments and
+        the keyword names, so it is computed once per distinct call shape.
+        """
+        keys = tuple(keyword.key for keyword in kwargs)
+        if len(set(keys)) != len(keys):
+            return "duplicate keyword argument"
 
-        return nodes.Output([call_node], lineno=lineno)
+        shape = (len(args), keys)
+        try:
+            return self._argument_errors[shape]
+        except KeyError:
+            pass
 
-    def render_wrapper(self, *args, **kwargs):
-        self.context: Context = kwargs.pop("_context")
-        self.template: str = kwargs.pop("_template")
-        self.lineno: int = kwargs.pop("_lineno")
-        self.tag_name: str = kwargs.pop("_tag_name")
-        return self.render(*args, **kwargs)
+        bound_kwargs = dict.fromkeys(self.get_implicit_kwargs())
+        bound_kwargs.update(zip(keys, itertools.repeat(None)))
 
-    def render(self, *args, **kwargs):
-        raise NotImplementedError
+        error = None
+        for signature in self.get_signatures():
+            try:
+                signature.bind(*itertools.repeat(None, len(args)), **bound_kwargs)
+            except TypeError as exc:
+                error = str(exc)
+                break
 
+        self._argument_errors[shape] = error
+        return error
 
-class ContainerTag(BaseTemplateTag):
-    def create_node(
+    def get_implicit_kwargs(self) -> Tuple[str, ...]:
+        """
+        Return the names of the keyword arguments that are passed to the render
+        methods by the tag itself rather than by the template.
+        """
+        return self.implicit_kwargs
+
+    def get_signatures(self) -> List[inspect.Signature]:
+        """
+        Return the signatures the tag arguments are checked against.
+        """
+        if self._signatures is None:
+            if self.arguments is not None:
+                signatures = [_parse_argument_spec(self.arguments, self.get_implicit_kwargs())]
+            else:
+                signatures = []
+                for name in self.signature_methods:
+                    try:
+                        signatures.append(inspect.signature(getattr(self, name)))
+                    except (TypeError, ValueError):
+                        continue
+            self._signatures = signatures
+        return self._signatures
+
+    def warm_up(self):
+        """
+        Fill the caches of the tag ahead of the first render.
+        Called by the module-level `warm_up()` function.
+        """
+        self.get_signatures()
+
+    def get_static_templates(self, args: tuple, kwargs: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+        """
+        Return the names of the templates a call with the given arguments
+        may render, or None if they can't be determined without rendering.
+        Arguments that aren't literals are passed as Jinja2 nodes.
+        Called by `build_index()`.
+        """
+        return ()
+
+    def call_invoke(
         self,
-        parser: Parser,
         args: List[nodes.Expr],
         kwargs: List[nodes.Keyword],
         *,
         lineno: int,
-        **options
-    ) -> nodes.Node:
-        call_node = self.call_method("render_wrapper", args, kwargs, lineno=lineno)
-        body = parser.parse_statements(("name:end%s" % options["tag_name"],), drop_needle=True)
-        call_block = nodes.CallBlock(call_node, [], [], body).set_lineno(lineno)
-        if options["target"]:
-            target_node = nodes.Name(options["target"], "store", lineno=lineno)
-            return nodes.AssignBlock(target_node, None, [call_block], lineno=lineno)
-        return call_block
+        name: str = "invoke",
+        method: Optional[str] = None,
+        trusted: Optional[bool] = None
+    ) -> nodes.Expr:
+        """
+        Create a node that calls the tag. The context and the static metadata
+        of the call site (template name, line number and tag name) are moved
+        from `kwargs` to the positional arguments, the latter as a single
+        constant tuple.
 
-    def render_wrapper(self, *args, **kwargs):
-        self.context: Context = kwargs.pop("_context")
-        self.template: str = kwargs.pop("_template")
-        self.lineno: int = kwargs.pop("_lineno")
-        self.tag_name: str = kwargs.pop("_tag_name")
-        return self.render(*args, **kwargs)
+        `method` is the name of the render method passed to dispatching
+        methods, like `invoke_deferred()`.
 
-    def render(self, *args, **kwargs):
-        raise NotImplementedError
+        In async environments the `_async` variant of the method is called,
+        which is awaited by the generated template code.
 
+        The calls of trusted tags in sandboxed environments are not checked by
+        the sandbox. Pass `trusted=False` where a `nodes.Call` is required.
+        """
+        metadata = {}  # type: Dict[str, Any]
+        call_kwargs = []
+        for keyword in kwargs:
+            if keyword.key in _METADATA_KEYS:
+                metadata[keyword.key] = keyword.value
+            else:
+                call_kwargs.append(keyword)
 
-class InclusionTag(StandaloneTag):
-    template_name = None
-    safe_output = True
+        site = nodes.Const(
+            (
+                metadata["_template"].value,
+                metadata["_lineno"].value,
+                metadata["_tag_name"].value
+            ),
+            lineno=lineno
+        )
+        call_args = [metadata["_context"], site]
+        if method is not None:
+            call_args.append(nodes.Const(method))
+        elif self.tag_observer is not None and name in _OBSERVED_METHODS:
+            # The choice is made at compile time, so that templates compiled
+            # without an observer don't pay for the instrumentation.
+            call_args.append(nodes.Const(_OBSERVED_METHODS[name]))
+            name = "invoke_observed"
+        call_args.extend(args)
 
-    def render(self, *args, **kwargs):
-        template_names = self.get_template_names(*args, **kwargs)
-        if isinstance(template_names, str):
-            template = self.environment.get_template(template_names)
-        else:
-            template = self.environment.select_template(template_names)
+        if self.environment.is_async:
+            name += "_async"
 
-        context = template.new_context(
-            dict(self.context.get_all(), **self.get_context(*args, **kwargs)),
-            shared=True
-        )
-        return template.render(context)
+        if trusted is None:
+            trusted = self.is_trusted()
+        if trusted:
+            return nodes.Filter(
+                call_args[0],
+                _trusted_filter_name(self.identifier, name),
+                call_args[1:],
+                call_kwargs,
+                None,
+                None,
+                lineno=lineno
+            )
+        return self.call_method(name, call_args, call_kwargs, lineno=lineno)
 
-    def get_context(self, *args, **kwargs):
-        return {}
+    def is_async_tag(self) -> bool:
+        """
+        Return True if the tag defines coroutine hooks and therefore can only be
+        used within an async environment.
+        """
+        return inspect.iscoroutinefunction(self.render)
 
-    def get_template_names(self, *args, **kwargs):
+    def is_trusted(self) -> bool:
+        """
+        Return True if the calls of the tag skip the call checks of the sandbox.
+        """
+        return self.trusted and self.environment.sandboxed
+
+    @property
+    def tag_observer(self):
+        """
+        The observer assigned to the `tag_observer` attribute of the environment.
+        """
+        return getattr(self.environment, "tag_observer", None)
+
+    def is_lazy(self) -> bool:
+        """
+        Return True if the output assigned with `as` is a `LazyOutput`.
+        Async environments can't render outside of the template code,
+        so they always assign the rendered output.
+        """
+        return self.lazy and not self.environment.is_async
+
+    def call_in_place(self, context: Context, site: Tuple[Optional[str], int, str], method: str, args, kwargs):
+        """
+        Call a render method where its output is processed rather than written out,
+        like a `LazyOutput`. Batched and deferred tags rendered by the call are rendered
+        in place, because their placeholders would not be replaced.
+        """
+        with _in_place():
+            result = self.call_in_frame(CallFrame(context, site), method, args, kwargs)
+
+        if method in _STREAM_METHODS:
+            return _stream_in_place(result)
+        return result
+
+    def call_in_frame(self, frame: CallFrame, method: str, args, kwargs):
+        """
+        Call a render method with the frame bound. The call is reported
+        to the observer, if there is one.
+        """
+        if self.tag_observer is not None:
+            return self.observe_call(frame, method, args, kwargs)
+
+        token = _current_frame.set(frame)
+        try:
+            result = getattr(self, method)(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+        if method in _STREAM_METHODS:
+            return _stream_in_frame(frame, result)
+        return result
+
+    async def call_in_frame_async(self, frame: CallFrame, method: str, args, kwargs):
+        if self.tag_observer is not None:
+            return await self.observe_call_async(frame, method, args, kwargs)
+
+        token = _current_frame.set(frame)
+        try:
+            return await getattr(self, method + "_async")(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    def invoke(self, context: Context, site: Tuple[Optional[str], int, str], *args, **kwargs):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return self.render(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    async def invoke_async(self, context: Context, site: Tuple[Optional[str], int, str], *args, **kwargs):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return await self.render_async(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    def invoke_observed(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        return self.observe_call(CallFrame(context, site), method, args, kwargs)
+
+    def observe_call(self, frame: CallFrame, method: str, args, kwargs):
+        """
+        Call a render method with the frame bound, reporting the call to the observer.
+        """
+        enter = getattr(self.tag_observer, "enter", None)
+        if enter is not None:
+            enter(frame, _current_frame.get())
+
+        token = _current_frame.set(frame)
+        start = time.perf_counter()
+        try:
+            result = getattr(self, method)(*args, **kwargs)
+        except Exception:
+            self.notify_observer(frame, time.perf_counter() - start)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_frame.reset(token)
+
+        if method in _STREAM_METHODS:
+            return _observe_stream(self, frame, result, duration)
+
+        self.notify_observer(frame, duration, len(result) if isinstance(result, str) else None)
+        return result
+
+    async def invoke_observed_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        return await self.observe_call_async(CallFrame(context, site), method, args, kwargs)
+
+    async def observe_call_async(self, frame: CallFrame, method: str, args, kwargs):
+        enter = getattr(self.tag_observer, "enter", None)
+        if enter is not None:
+            enter(frame, _current_frame.get())
+
+        token = _current_frame.set(frame)
+        start = time.perf_counter()
+        try:
+            result = await getattr(self, method + "_async")(*args, **kwargs)
+        except Exception:
+            self.notify_observer(frame, time.perf_counter() - start)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_frame.reset(token)
+
+        if method in _STREAM_METHODS:
+            if inspect.isasyncgen(result):
+                return _observe_stream_async(self, frame, result, duration)
+            return _observe_stream(self, frame, result, duration)
+
+        self.notify_observer(frame, duration, len(result) if isinstance(result, str) else None)
+        return result
+
+    def notify_observer(self, frame: CallFrame, duration: float, size: Optional[int] = None):
+        """
+        Report a finished call to the observer. `size` is the length of the
+        output, or None if the call has failed.
+        """
+        observer = self.tag_observer
+        if observer is None:
+            return
+
+        leave = getattr(observer, "leave", None)
+        if leave is not None:
+            leave(frame, duration, size)
+        else:
+            observer(frame.tag_name, frame.template, frame.lineno, duration, frame.cache_hit)
+
+    def render_wrapper(self, *args, **kwargs):
+        """
+        Entry point for call nodes created with
+        `self.call_method("render_wrapper", args, kwargs)`, where `kwargs`
+        contains the metadata keywords passed to `create_node()`.
+        """
+        context = kwargs.pop("_context")
+        site = (kwargs.pop("_template"), kwargs.pop("_lineno"), kwargs.pop("_tag_name"))
+        return self.invoke(context, site, *args, **kwargs)
+
+    async def render_async(self, *args, **kwargs):
+        result = self.render(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def render(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+class StandaloneTag(BaseTemplateTag):
+    safe_output: ClassVar[bool] = False
+    pure: ClassVar[bool] = False
+    deferred: ClassVar[bool] = False
+    cache_backend: ClassVar[Any] = None
+    cache_timeout: ClassVar[Optional[float]] = None
+    cache_context_keys: ClassVar[Tuple[str, ...]] = ()
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self._cache_locks = _KeyLocks()
+        self._pending_renders: "Dict[Any, asyncio.Future]" = {}
+
+    def create_node(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        *,
+        lineno: int,
+        **options
+    ) -> nodes.Node:
+        call_node = None
+        if self.pure:
+            call_node = self.render_constant(args, kwargs, lineno=lineno)
+        if call_node is None and options["target"] and self.is_lazy():
+            method = "render_cached" if self.cache_backend is not None else "render"
+            call_node = self.call_invoke(args, kwargs, lineno=lineno, name="invoke_lazy", method=method)
+            target_node = nodes.Name(options["target"], "store", lineno=lineno)
+            return nodes.Assign(target_node, call_node, lineno=lineno)
+
+        if call_node is None:
+            if self.is_in_place(options):
+                method = "render_cached" if self.cache_backend is not None else "render"
+                call_node = self.call_invoke(
+                    args,
+                    kwargs,
+                    lineno=lineno,
+                    name="invoke_in_place",
+                    method=method
+                )
+            elif not options["target"] and (self.deferred or self.is_batched()):
+                method = "render_cached" if self.cache_backend is not None else "render"
+                call_node = self.call_invoke(
+                    args,
+                    kwargs,
+                    lineno=lineno,
+                    name="invoke_deferred",
+                    method=method
+                )
+            else:
+                name = "invoke_cached" if self.cache_backend is not None else "invoke"
+                call_node = self.call_invoke(args, kwargs, lineno=lineno, name=name)
+
+        if self.safe_output:
+            call_node = nodes.MarkSafeIfAutoescape(call_node, lineno=lineno)
+
+        if options["target"]:
+            target_node = nodes.Name(options["target"], "store", lineno=lineno)
+            return nodes.Assign(target_node, call_node, lineno=lineno)
+
+        return nodes.Output([call_node], lineno=lineno)
+
+    def is_in_place(self, options: Dict[str, Any]) -> bool:
+        """
+        Return True if the call is rendered with the deferral disabled, because
+        its output is assigned or processed by the template (see `is_captured()`).
+        Only the templates of environments with `DeferredTemplate` pay for it.
+        """
+        return bool(options["target"] or options.get("captured")) and issubclass(
+            self.environment.template_class,
+            DeferredTemplate
+        )
+
+    def render_constant(
+        self,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        *,
+        lineno: int
+    ) -> Optional[nodes.Const]:
+        """
+        Render a pure tag at compile time. Returns None if some of the arguments
+        are not constants or the result can't be stored in the compiled template.
+        In that case the tag is rendered at runtime as usual.
+        """
+        if inspect.iscoroutinefunction(self.render):
+            return None
+
+        constants = [arg for arg in args if isinstance(arg, nodes.Const)]
+        if len(constants) != len(args):
+            return None
+
+        values = {}
+        for keyword in kwargs:
+            if keyword.key == "_context":
+                continue
+            if not isinstance(keyword.value, nodes.Const):
+                return None
+            values[keyword.key] = keyword.value.value
+
+        frame = CallFrame(None, (values.pop("_template"), values.pop("_lineno"), values.pop("_tag_name")))
+        token = _current_frame.set(frame)
+        try:
+            value = self.render(*[arg.value for arg in constants], **values)
+            return nodes.Const.from_untrusted(value, lineno=lineno, environment=self.environment)
+        except Exception:
+            # errors are reported at runtime, where they used to be
+            return None
+        finally:
+            _current_frame.reset(token)
+
+    def invoke_cached(self, context: Context, site: Tuple[Optional[str], int, str], *args, **kwargs):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return self.render_cached(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    async def invoke_cached_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        *args,
+        **kwargs
+    ):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return await self.render_cached_async(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    def invoke_lazy(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ) -> LazyOutput:
+        safe = self.safe_output and context.eval_ctx.autoescape
+
+        def render():
+            value = self.call_in_place(context, site, method, args, kwargs)
+            return Markup(value) if safe else value
+
+        return LazyMarkup(render) if safe else LazyOutput(render)
+
+    def invoke_in_place(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        return self.call_in_place(context, site, method, args, kwargs)
+
+    async def invoke_in_place_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        with _in_place():
+            return await self.call_in_frame_async(CallFrame(context, site), method, args, kwargs)
+
+    def invoke_deferred(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        frame = CallFrame(context, site)
+        scheduler = _current_scheduler.get()
+        if scheduler is None:
+            return self.call_in_frame(frame, method, args, kwargs)
+
+        token = _current_frame.set(frame)
+        try:
+            key = self.get_batch_key(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+        return scheduler.defer(_DeferredCall(self, frame, method, args, kwargs, key))
+
+    async def invoke_deferred_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ):
+        frame = CallFrame(context, site)
+        scheduler = _current_scheduler.get()
+        if scheduler is None:
+            return await self.call_in_frame_async(frame, method, args, kwargs)
+
+        token = _current_frame.set(frame)
+        try:
+            key = self.get_batch_key(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+        return scheduler.defer(_DeferredCall(self, frame, method, args, kwargs, key))
+
+    def is_batched(self) -> bool:
+        """
+        Return True if the tag loads its data with `load_many()`.
+        """
+        return type(self).load_many is not StandaloneTag.load_many
+
+    def get_batch_key(self, *args, **kwargs):
+        """
+        Return the key of the data needed by the tag call, or None
+        if the call doesn't need any.
+        """
+        return None
+
+    def load_many(self, keys: List[Any]) -> Dict[Any, Any]:
+        """
+        Load the data for the given keys and return a dictionary
+        that maps the keys to the loaded values. May be a coroutine.
+        """
+        raise NotImplementedError
+
+    def load(self, key):
+        """
+        Return the value loaded for the key. When a `DeferredTemplate` is being
+        rendered, the value is taken from the batch loaded for all the calls
+        of the tag. Otherwise, `load_many()` is called for this key alone.
+        """
+        scheduler = _current_scheduler.get()
+        if scheduler is not None:
+            loaded = scheduler.loaded.get(self, {})
+            if key in loaded:
+                return loaded[key]
+        return self.load_many([key]).get(key)
+
+    async def load_async(self, key):
+        scheduler = _current_scheduler.get()
+        if scheduler is not None:
+            loaded = scheduler.loaded.get(self, {})
+            if key in loaded:
+                return loaded[key]
+
+        values = self.load_many([key])
+        if inspect.isawaitable(values):
+            values = await values
+        return values.get(key)
+
+    def get_cache_key(self, *args, **kwargs) -> Optional[str]:
+        """
+        Return the key under which the output of the tag is cached,
+        or None to skip the cache for this call.
+
+        By default, the key is built from the arguments of the tag
+        and the values of the context variables listed in `cache_context_keys`.
+        The call is not cached if some of these values are not strings, numbers,
+        booleans, None or tuples of them, because the `repr()` of other objects
+        doesn't identify their content.
+        """
+        context = self.context
+        context_values = [context.get(key) for key in self.cache_context_keys]
+        if not _is_key_value((args, tuple(kwargs.values()), tuple(context_values))):
+            return None
+
+        return repr((
+            args,
+            sorted(kwargs.items()),
+            context_values
+        ))
+
+    def make_cache_key(self, *args, **kwargs) -> Optional[str]:
+        key = self.get_cache_key(*args, **kwargs)
+        if key is None:
+            return None
+        return "{}:{}".format(self.identifier, key)
+
+    def render_cached(self, *args, **kwargs):
+        key = self.make_cache_key(*args, **kwargs)
+        if key is None:
+            return self.render(*args, **kwargs)
+
+        frame = _current_frame.get()
+        value = self.cache_backend.get(key, _missing)
+        if value is not _missing:
+            frame.cache_hit = True
+            return value
+
+        frame.cache_hit = False
+
+        # Only one thread renders a missing value,
+        # the others wait for it and take the result from the cache.
+        with self._cache_locks.hold(key):
+            value = self.cache_backend.get(key, _missing)
+            if value is _missing:
+                # the cached output can't contain placeholders of deferred calls
+                with _in_place():
+                    value = self.render(*args, **kwargs)
+                self.cache_backend.set(key, value, self.cache_timeout)
+        return value
+
+    async def render_cached_async(self, *args, **kwargs):
+        import asyncio
+
+        key = self.make_cache_key(*args, **kwargs)
+        if key is None:
+            return await self.render_async(*args, **kwargs)
+
+        frame = _current_frame.get()
+        value = self.cache_backend.get(key, _missing)
+        if value is not _missing:
+            frame.cache_hit = True
+            return value
+
+        frame.cache_hit = False
+        loop = asyncio.get_event_loop()
+        pending_key = (id(loop), key)
+        future = self._pending_renders.get(pending_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._pending_renders[pending_key] = loop.create_future()
+        try:
+            with _in_place():
+                value = await self.render_async(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # mark as retrieved
+            raise
+        else:
+            self.cache_backend.set(key, value, self.cache_timeout)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending_renders[pending_key]
+
+    def render(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+class ContainerTag(BaseTemplateTag):
+    implicit_kwargs: ClassVar[Tuple[str, ...]] = ("caller",)
+
+    def get_implicit_kwargs(self) -> Tuple[str, ...]:
+        if self.is_streaming():
+            # the body of a streaming tag is passed as the first argument
+            return ()
+        return self.implicit_kwargs
+
+    def create_node(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        *,
+        lineno: int,
+        **options
+    ) -> Union[nodes.Node, List[nodes.Node]]:
+        hidden = self.is_streaming() or bool(options["target"] and self.is_lazy())
+        if hidden and not hasattr(nodes, "DerivedContextReference"):
+            # the local variables can't be passed to a hidden block before Jinja2 2.11
+            parser.fail(
+                "Tag {!r} renders its body in a hidden block, "
+                "which requires Jinja2 2.11 or later".format(options["tag_name"]),
+                lineno
+            )
+
+        body = parser.parse_statements(("name:end%s" % options["tag_name"],), drop_needle=True)
+        if options["target"] and self.is_lazy():
+            return self.create_lazy_block(parser, args, kwargs, body, lineno=lineno, **options)
+        if self.is_streaming():
+            return self.create_stream_block(parser, args, kwargs, body, lineno=lineno, **options)
+        return self.create_call_block(args, kwargs, body, lineno=lineno, **options)
+
+    def create_stream_block(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        body: List[nodes.Node],
+        *,
+        lineno: int,
+        **options
+    ) -> nodes.Node:
+        """
+        Compile the body into a scoped block, which Jinja renders with
+        a generator, and pass the output of `render_stream()` chunk by chunk
+        to the output of the template.
+        """
+        block_name, hidden_block = self.create_hidden_block(parser, body, lineno=lineno)
+        kwargs = self.derive_context(kwargs, lineno=lineno)
+        call_node = self.call_invoke(
+            [nodes.Const(block_name)] + args,
+            kwargs,
+            lineno=lineno,
+            name="invoke_body_stream"
+        )
+        loop = nodes.For(
+            nodes.Name("_chunk", "store"),
+            call_node,
+            [nodes.Output([nodes.Name("_chunk", "load")], lineno=lineno)],
+            [],
+            None,
+            False,
+            lineno=lineno
+        )
+
+        if options["target"]:
+            target_node = nodes.Name(options["target"], "store", lineno=lineno)
+            return nodes.AssignBlock(target_node, None, [hidden_block, loop], lineno=lineno)
+        return nodes.Scope([hidden_block, loop], lineno=lineno)
+
+    def create_lazy_block(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        body: List[nodes.Node],
+        *,
+        lineno: int,
+        **options
+    ) -> List[nodes.Node]:
+        """
+        Compile the body into a scoped block and assign a `LazyOutput`
+        that renders the tag and its body on first use.
+        """
+        block_name, hidden_block = self.create_hidden_block(parser, body, lineno=lineno)
+        kwargs = self.derive_context(kwargs, lineno=lineno)
+        call_node = self.call_invoke(
+            [nodes.Const(block_name)] + args,
+            kwargs,
+            lineno=lineno,
+            name="invoke_lazy_body"
+        )
+        target_node = nodes.Name(options["target"], "store", lineno=lineno)
+        return [hidden_block, nodes.Assign(target_node, call_node, lineno=lineno)]
+
+    def create_hidden_block(
+        self,
+        parser: Parser,
+        body: List[nodes.Node],
+        *,
+        lineno: int
+    ) -> Tuple[str, nodes.Node]:
+        """
+        Wrap the body into a scoped block, which is not rendered in place,
+        but can be rendered with `context.blocks[block_name]`.
+        """
+        block_name = "_jst_{}_{}".format(
+            hashlib.sha1(repr((parser.name, parser.filename)).encode()).hexdigest()[:8],
+            parser.free_identifier(lineno).name
+        )
+        block_fields = {"name": block_name, "body": body, "scoped": True, "required": False}
+        block = nodes.Block(*(block_fields[field] for field in nodes.Block.fields), lineno=lineno)
+
+        # The block must exist in the template, but must not be rendered in place.
+        if_fields = {"test": nodes.Const(False), "body": [block], "elif_": [], "else_": []}
+        hidden_block = nodes.If(*(if_fields[field] for field in nodes.If.fields), lineno=lineno)
+        return block_name, hidden_block
+
+    def derive_context(self, kwargs: List[nodes.Keyword], *, lineno: int) -> List[nodes.Keyword]:
+        """
+        Pass a context with the local variables of the call site,
+        so that a hidden block can see them.
+        """
+        return [
+            nodes.Keyword("_context", nodes.DerivedContextReference(), lineno=lineno)
+            if keyword.key == "_context" else keyword
+            for keyword in kwargs
+        ]
+
+    def create_call_block(
+        self,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        body: List[nodes.Node],
+        *,
+        lineno: int,
+        **options
+    ) -> nodes.Node:
+        # `caller` is only passed to a call node
+        call_node = self.call_invoke(args, kwargs, lineno=lineno, trusted=False)
+        call_block = nodes.CallBlock(call_node, [], [], body).set_lineno(lineno)
+        if options["target"]:
+            target_node = nodes.Name(options["target"], "store", lineno=lineno)
+            return nodes.AssignBlock(target_node, None, [call_block], lineno=lineno)
+        return call_block
+
+    async def render_async(self, *args, **kwargs):
+        caller = kwargs.get("caller")
+        if caller is not None and not inspect.iscoroutinefunction(self.render):
+            # In async environments `caller()` returns a coroutine.
+            # Render the body beforehand so that synchronous `render()`
+            # implementations keep working.
+            body = await caller()
+            kwargs["caller"] = lambda: body
+        return await super().render_async(*args, **kwargs)
+
+    def is_streaming(self) -> bool:
+        return type(self).render_stream is not ContainerTag.render_stream
+
+    def is_async_tag(self) -> bool:
+        return super().is_async_tag() or inspect.isasyncgenfunction(self.render_stream)
+
+    def get_signatures(self) -> List[inspect.Signature]:
+        if self._signatures is None and self.arguments is None and self.is_streaming():
+            signature = inspect.signature(self.render_stream)
+            parameters = list(signature.parameters.values())[1:]  # skip the body
+            self._signatures = [signature.replace(parameters=parameters)]
+        return super().get_signatures()
+
+    def invoke_body_stream(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        block_name: str,
+        *args,
+        **kwargs
+    ):
+        frame = CallFrame(context, site)
+        token = _current_frame.set(frame)
+        try:
+            stream = self.render_body_stream(block_name, *args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+        return _stream_in_frame(frame, stream)
+
+    async def invoke_body_stream_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        block_name: str,
+        *args,
+        **kwargs
+    ):
+        frame = CallFrame(context, site)
+        token = _current_frame.set(frame)
+        try:
+            stream = await self.render_body_stream_async(block_name, *args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+        if inspect.isasyncgen(stream):
+            return _stream_in_frame_async(frame, stream)
+        return _stream_in_frame(frame, stream)
+
+    def render_body_stream(self, block_name: str, *args, **kwargs):
+        """
+        Pass the body, compiled into the block `block_name`, to `render_stream()`.
+        """
+        context = self.context
+        markup = Markup if context.eval_ctx.autoescape else str
+        body = (markup(chunk) for chunk in context.blocks[block_name][0](context))
+        return self.render_stream(body, *args, **kwargs)
+
+    async def render_body_stream_async(self, block_name: str, *args, **kwargs):
+        context = self.context
+        markup = Markup if context.eval_ctx.autoescape else str
+        # in async environments the block render functions are async generators
+        render_block = context.blocks[block_name][0]  # type: Any
+        body = (markup(chunk) async for chunk in render_block(context))
+        if not inspect.isasyncgenfunction(self.render_stream):
+            # Synchronous implementations can't consume an async generator,
+            # so the body is rendered beforehand.
+            body = iter([chunk async for chunk in body])
+        return self.render_stream(body, *args, **kwargs)
+
+    def invoke_lazy_body(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        block_name: str,
+        *args,
+        **kwargs
+    ) -> LazyOutput:
+        autoescape = context.eval_ctx.autoescape
+        markup = Markup if autoescape else str
+        lazy_class = LazyMarkup if autoescape else LazyOutput
+
+        def render_body():
+            return (markup(chunk) for chunk in context.blocks[block_name][0](context))
+
+        if self.is_streaming():
+            def stream():
+                return self.call_in_place(context, site, "render_stream", (render_body(),) + args, kwargs)
+
+            def render_joined():
+                return _join_output(stream(), autoescape)
+
+            return lazy_class(render_joined, stream)
+
+        def render():
+            # every call of `caller` renders the body again, like in a call block
+            caller_kwargs = dict(kwargs, caller=lambda: markup("".join(render_body())))
+            # the output of a call block is not escaped
+            return markup(self.call_in_place(context, site, "render", args, caller_kwargs))
+
+        return lazy_class(render)
+
+    def render(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def render_stream(self, body, *args, **kwargs):
+        """
+        Transform the body, given as an iterator over its rendered chunks,
+        into an iterator over the output chunks. When overridden, the body
+        is not rendered into a single string first and `caller` is not passed.
+        """
+        raise NotImplementedError
+
+
+class InclusionTag(StandaloneTag):
+    template_name = None
+    safe_output = True
+    streaming: ClassVar[bool] = False
+    context_mode: ClassVar[str] = "layered"
+    context_keys: ClassVar[Tuple[str, ...]] = ()
+    template_cache_size: ClassVar[int] = 64
+    template_cache_timeout: ClassVar[Optional[float]] = None
+    template_cache_reload_timeout: ClassVar[Optional[float]] = 1.0
+    inline: ClassVar[bool] = False
+    signature_methods: ClassVar[Tuple[str, ...]] = ("render", "get_context", "get_template_names")
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        if self.template_cache_size:
+            self.template_cache = MemoryCache(
+                max_size=self.template_cache_size,
+                timeout=self.template_cache_timeout
+            )
+        else:
+            self.template_cache = None
+        self._inline_state = threading.local()
+        self._inline_templates = {}  # type: Dict[Tuple[str, bool, FrozenSet[str]], tuple]
+
+    def create_node(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        *,
+        lineno: int,
+        **options
+    ) -> nodes.Node:
+        if self.can_inline() and not (options["target"] and self.is_lazy()):
+            node = self.create_inline_node(parser, args, kwargs, lineno=lineno, **options)
+            if node is not None:
+                return node
+
+        if (
+            not self.streaming
+            or options["target"]
+            or self.is_in_place(options)
+            or self.cache_backend is not None
+            or self.deferred
+            or self.is_batched()
+        ):
+            return super().create_node(parser, args, kwargs, lineno=lineno, **options)
+
+        # Write the events of the included template directly
+        # into the output of the parent template.
+        call_node = self.call_invoke(args, kwargs, lineno=lineno, name="invoke_stream")
+        event_node = nodes.MarkSafeIfAutoescape(nodes.Name("_event", "load"), lineno=lineno)
+        return nodes.For(
+            nodes.Name("_event", "store"),
+            call_node,
+            [nodes.Output([event_node], lineno=lineno)],
+            [],
+            None,
+            False,
+            lineno=lineno
+        )
+
+    def can_inline(self) -> bool:
+        """
+        Return True if the template of the tag can be expanded into the parent
+        template at compile time. This requires `inline = True`, a fixed
+        `template_name` and no caching, deferring or custom rendering.
+        """
+        cls = type(self)
+        return (
+            self.inline
+            and isinstance(self.template_name, str)
+            and cls.get_template_names is InclusionTag.get_template_names
+            and cls.render is InclusionTag.render
+            and cls.render_stream is InclusionTag.render_stream
+            and cls.create_context is InclusionTag.create_context
+            and self.safe_output
+            and self.cache_backend is None
+            and not self.deferred
+            and not self.is_batched()
+        )
+
+    def create_inline_node(
+        self,
+        parser: Parser,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        *,
+        lineno: int,
+        target: Optional[str] = None,
+        **options
+    ) -> Optional[nodes.Node]:
+        """
+        Expand the included template into the parent template, like a scoped
+        `{% with %}` block over the result of `get_context()`. Returns None
+        if the template can't be inlined.
+        """
+        name = self.template_name
+        expanding: FrozenSet[str] = getattr(self._inline_state, "names", frozenset())
+        if name in expanding or self.environment.loader is None:
+            return None
+
+        # the tags of the template are captured along with the call
+        captured = bool(getattr(_parse_state, "captured", False) or target or options.get("captured"))
+        key = (name, captured, expanding)
+        entry = self._inline_templates.get(key)
+        if entry is None or (self.environment.auto_reload and entry[0] is not None and not entry[0]()):
+            entry = self._inline_templates[key] = self.parse_inline_template(name, captured, expanding)
+
+        _, names, template = entry
+        if template is None:
+            return None
+
+        # The parsed template is shared by the call sites, so its nodes are copied.
+        # Errors in the expanded nodes are reported at the line of the tag.
+        template = _copy_nodes(template, lineno)
+
+        autoescape = self.environment.autoescape
+        if callable(autoescape):
+            autoescape = autoescape(name)
+        body = [
+            nodes.ScopedEvalContextModifier(
+                [nodes.Keyword("autoescape", nodes.Const(autoescape), lineno=lineno)],
+                template.body,
+                lineno=lineno
+            )
+        ]
+
+        call_node = self.call_invoke([nodes.Const(names)] + args, kwargs, lineno=lineno, name="invoke_inline")
+        if names:
+            targets = [nodes.Tuple([nodes.Name(key, "store") for key in names], "store", lineno=lineno)]
+            node = nodes.With(targets, [call_node], body, lineno=lineno)
+        else:
+            node = nodes.With([], [], [nodes.ExprStmt(call_node, lineno=lineno)] + body, lineno=lineno)
+
+        if target:
+            return nodes.AssignBlock(nodes.Name(target, "store"), None, [node], lineno=lineno)
+        return node
+
+    def parse_inline_template(self, name: str, captured: bool, expanding: FrozenSet[str]):
+        """
+        Parse the template for `create_inline_node()`. Returns the `uptodate`
+        function of the loader, the free variables of the template and its node,
+        which is None if the template can't be inlined.
+        """
+        source, filename, uptodate = self.environment.loader.get_source(self.environment, name)
+        parent_captured = getattr(_parse_state, "captured", False)
+        self._inline_state.names = expanding | {name}
+        _parse_state.captured = captured
+        try:
+            template = self.environment.parse(source, name, filename)
+        finally:
+            self._inline_state.names = expanding
+            _parse_state.captured = parent_captured
+
+        # Template inheritance, macros and imports rely on the template
+        # being rendered on its own.
+        if any(template.find_all((nodes.Extends, nodes.Block, nodes.Macro, nodes.Import, nodes.FromImport))):
+            return uptodate, (), None
+
+        from jinja2 import meta
+
+        # The free variables of the included template are bound to the values
+        # returned by `invoke_inline()`.
+        names = tuple(sorted(meta.find_undeclared_variables(template)))
+        return uptodate, names, template
+
+    def invoke_inline(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        names: Tuple[str, ...],
+        *args,
+        **kwargs
+    ) -> tuple:
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return self.render_inline(names, *args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    async def invoke_inline_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        names: Tuple[str, ...],
+        *args,
+        **kwargs
+    ) -> tuple:
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return await self.render_inline_async(names, *args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    def render_inline(self, names: Tuple[str, ...], *args, **kwargs) -> tuple:
+        """
+        Return the values of the free variables of the inlined template.
+        The template itself is rendered by the parent template.
+        """
+        return self.resolve_inline_names(names, self.get_context(*args, **kwargs))
+
+    async def render_inline_async(self, names: Tuple[str, ...], *args, **kwargs) -> tuple:
+        extra_context = self.get_context(*args, **kwargs)
+        if inspect.isawaitable(extra_context):
+            extra_context = await extra_context
+        return self.resolve_inline_names(names, extra_context)
+
+    def resolve_inline_names(self, names: Tuple[str, ...], extra_context: Dict[str, Any]) -> tuple:
+        """
+        Look up the free variables of an inlined template in the same order
+        as `create_context()` would.
+        """
+        context = self.context
+        if self.context_mode in ("layered", "copy"):
+            def lookup(key):
+                return context.resolve_or_missing(key)
+        elif self.context_mode == "isolated":
+            def lookup(key):
+                if key in self.context_keys:
+                    return context.resolve_or_missing(key)
+                return self.environment.globals.get(key, missing)
+        else:
+            raise ValueError("Invalid context mode: {!r}".format(self.context_mode))
+
+        values = []
+        for key in names:
+            value = extra_context[key] if key in extra_context else lookup(key)
+            if value is missing:
+                value = self.environment.undefined(name=key)
+            values.append(value)
+        return tuple(values)
+
+    def invoke_lazy(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        method: str,
+        *args,
+        **kwargs
+    ) -> LazyOutput:
+        if method != "render" or type(self).render is not InclusionTag.render:
+            return super().invoke_lazy(context, site, method, *args, **kwargs)
+
+        # the included template can be iterated event by event
+        safe = self.safe_output and context.eval_ctx.autoescape
+        wrap = Markup if safe else str
+
+        def stream():
+            return (wrap(event) for event in self.call_in_place(context, site, "render_stream", args, kwargs))
+
+        def render():
+            return wrap("".join(stream()))
+
+        return (LazyMarkup if safe else LazyOutput)(render, stream)
+
+    def invoke_stream(self, context: Context, site: Tuple[Optional[str], int, str], *args, **kwargs):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return self.render_stream(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    async def invoke_stream_async(
+        self,
+        context: Context,
+        site: Tuple[Optional[str], int, str],
+        *args,
+        **kwargs
+    ):
+        token = _current_frame.set(CallFrame(context, site))
+        try:
+            return await self.render_stream_async(*args, **kwargs)
+        finally:
+            _current_frame.reset(token)
+
+    def render(self, *args, **kwargs):
+        if self.environment.is_async:
+            return self._render_async(*args, **kwargs)
+        return "".join(self.render_stream(*args, **kwargs))
+
+    async def _render_async(self, *args, **kwargs):
+        stream = await self.render_stream_async(*args, **kwargs)
+        return "".join([event async for event in stream])
+
+    def render_stream(self, *args, **kwargs):
+        """
+        Return an iterator over the rendered chunks of the included template.
+        The template and its context are resolved immediately, while the
+        template itself is rendered lazily.
+        """
+        template = self.resolve_template(*args, **kwargs)
+        context = self.create_context(template, self.get_context(*args, **kwargs))
+        self._set_included(template)
+        return template.root_render_func(context)
+
+    async def render_stream_async(self, *args, **kwargs):
+        template = self.resolve_template(*args, **kwargs)
+        extra_context = self.get_context(*args, **kwargs)
+        if inspect.isawaitable(extra_context):
+            extra_context = await extra_context
+        self._set_included(template)
+        return template.root_render_func(self.create_context(template, extra_context))
+
+    def _set_included(self, template):
+        frame = _current_frame.get()
+        if frame is not None:
+            frame.included = template.name
+
+    def create_context(self, template, extra_context: Dict[str, Any]) -> Context:
+        """
+        Create the context of the included template according to `context_mode`:
+
+        * "layered" - a read-only view over the tag context, the parent context
+          and the globals of the included template. Nothing is copied.
+        * "copy" - the parent context is copied into a new dictionary.
+        * "isolated" - only the tag context, the keys listed in `context_keys`
+          and the globals of the included template are available.
+        """
+        context = self.context
+        if self.context_mode == "layered":
+            parent = ChainMap(extra_context, context.vars, context.parent, template.globals)
+            return template.new_context(parent, shared=True)
+        elif self.context_mode == "copy":
+            return template.new_context(dict(context.get_all(), **extra_context))
+        elif self.context_mode == "isolated":
+            data = {
+                key: context[key]
+                for key in self.context_keys
+                if key in context
+            }
+            data.update(extra_context)
+            return template.new_context(data)
+
+        raise ValueError("Invalid context mode: {!r}".format(self.context_mode))
+
+    def is_async_tag(self) -> bool:
+        return super().is_async_tag() or inspect.iscoroutinefunction(self.get_context)
+
+    def resolve_template(self, *args, **kwargs):
+        """
+        Return the template selected by `get_template_names()`.
+
+        The selected template is remembered for the given candidates, so that
+        the missing candidates aren't looked up again on every call. A cached
+        template is dropped when the loader reports that it has changed.
+        """
+        template_names = self.get_template_names(*args, **kwargs)
+        return self.get_cached_template(template_names)
+
+    def get_cached_template(self, template_names):
+        auto_reload = self.environment.auto_reload
+        if self.template_cache is None or (auto_reload and self.template_cache_reload_timeout is None):
+            return self.load_template(template_names)
+
+        key = tuple(template_names) if isinstance(template_names, list) else template_names
+        template = self.template_cache.get(key)
+        if (
+            template is None
+            or template.environment is not self.environment
+            or (auto_reload and not template.is_up_to_date)
+        ):
+            template = self.load_template(template_names)
+            self.template_cache.set(key, template, self.get_template_cache_timeout())
+        return template
+
+    def get_template_cache_timeout(self) -> Optional[float]:
+        """
+        Return the lifetime of a template cache entry. With `auto_reload`,
+        a preferred candidate can appear at any time, so the entries expire
+        after `template_cache_reload_timeout` at the latest.
+        """
+        if not self.environment.auto_reload:
+            return self.template_cache_timeout
+        if self.template_cache_timeout is None:
+            return self.template_cache_reload_timeout
+        return min(self.template_cache_timeout, self.template_cache_reload_timeout)
+
+    def get_static_templates(self, args: tuple, kwargs: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+        if type(self).get_template_names is InclusionTag.get_template_names:
+            template_names = self.template_name
+        elif any(isinstance(value, nodes.Node) for value in itertools.chain(args, kwargs.values())):
+            return None
+        else:
+            try:
+                template_names = self.get_template_names(*args, **kwargs)
+            except Exception:
+                return None
+
+        if template_names is None:
+            return None
+        elif isinstance(template_names, str):
+            return (template_names,)
+        return tuple(template_names)
+
+    def warm_up(self):
+        """
+        Load the template declared by `template_name` into the template cache.
+        Tags that override `get_template_names()` are skipped, because their
+        templates depend on the arguments.
+        """
+        super().warm_up()
+        if (
+            self.template_name is not None
+            and type(self).get_template_names is InclusionTag.get_template_names
+        ):
+            self.get_cached_template(self.template_name)
+
+    def load_template(self, template_names):
+        if isinstance(template_names, str):
+            return self.environment.get_template(template_names)
+        return self.environment.select_template(template_names)
+
+    def get_context(self, *args, **kwargs):
+        return {}
+
+    def get_template_names(self, *args, **kwargs):
         if self.template_name is None:
             raise RuntimeError(
                 "InclusionTag requires either a definition of "
@@ -209,3 +2510,327 @@ class InclusionTag(StandaloneTag):
             )
         else:
             return self.template_name
+
+
+class CacheTag(ContainerTag):
+    """
+    Caches the rendered body of the tag:
+
+        {% cache "sidebar", user.id, timeout=300 %}...{% endcache %}
+
+    The positional arguments are added to the cache key. On a cache hit
+    the body is not rendered at all.
+    """
+    tags = {"cache"}
+    cache_backend: ClassVar[Any] = None
+    cache_size: ClassVar[Optional[int]] = 1024
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        if self.cache_backend is not None:
+            self.backend = self.cache_backend
+        else:
+            self.backend = MemoryCache(max_size=self.cache_size)
+        self._cache_locks = _KeyLocks()
+
+    def create_call_block(
+        self,
+        args: List[nodes.Expr],
+        kwargs: List[nodes.Keyword],
+        body: List[nodes.Node],
+        *,
+        lineno: int,
+        **options
+    ) -> nodes.Node:
+        # The checksum of the body is a part of the cache key,
+        # so that changes to the template invalidate the cached fragments.
+        checksum = hashlib.sha1(repr(body).encode()).hexdigest()[:12]
+        kwargs.append(nodes.Keyword("_checksum", nodes.Const(checksum), lineno=lineno))
+        return super().create_call_block(args, kwargs, body, lineno=lineno, **options)
+
+    def make_cache_key(self, vary_on, checksum: str) -> str:
+        return "{}:{}:{}:{}:{!r}".format(
+            self.identifier,
+            self.template,
+            self.lineno,
+            checksum,
+            vary_on
+        )
+
+    def render(self, *vary_on, timeout=None, _checksum=None, caller=None):
+        key = self.make_cache_key(vary_on, _checksum)
+        frame = _current_frame.get()
+        value = self.backend.get(key, _missing)
+        if value is not _missing:
+            frame.cache_hit = True
+            return value
+
+        frame.cache_hit = False
+
+        with self._cache_locks.hold(key):
+            value = self.backend.get(key, _missing)
+            if value is _missing:
+                value = caller()
+                self.backend.set(key, value, timeout)
+        return value
+
+    async def render_async(self, *vary_on, timeout=None, _checksum=None, caller=None):
+        key = self.make_cache_key(vary_on, _checksum)
+        frame = _current_frame.get()
+        value = self.backend.get(key, _missing)
+        if value is not _missing:
+            frame.cache_hit = True
+            return value
+
+        frame.cache_hit = False
+
+        value = await caller()
+        self.backend.set(key, value, timeout)
+        return value
+
+
+class TagUsage:
+    """
+    A tag call found by `build_index()`. Arguments that aren't literals
+    are kept as Jinja2 nodes. `templates` are the names of the templates
+    the call may render (None if unknown).
+    """
+    __slots__ = ("template", "lineno", "tag_name", "args", "kwargs", "templates")
+
+    def __init__(self, template, lineno, tag_name, args, kwargs, templates):
+        self.template = template  # type: str
+        self.lineno = lineno  # type: int
+        self.tag_name = tag_name  # type: str
+        self.args = args  # type: tuple
+        self.kwargs = kwargs  # type: Dict[str, Any]
+        self.templates = templates  # type: Optional[Tuple[str, ...]]
+
+    def __repr__(self):
+        return "<{} {}:{} - {}>".format(
+            type(self).__name__,
+            self.template,
+            self.lineno,
+            self.tag_name
+        )
+
+
+class TagIndex:
+    """
+    Tag calls and template references of the templates of an environment,
+    collected without rendering anything. Created by `build_index()`.
+    """
+
+    def __init__(self):
+        self.usages = {}  # type: Dict[str, List[TagUsage]]
+        self.references = {}  # type: Dict[str, set]
+        self._template = None  # type: Optional[str]
+
+    def record(self, extension, template, lineno, tag_name, args, kwargs):
+        # Templates expanded by inline tags are indexed on their own.
+        if template is None or template != self._template:
+            return
+
+        eval_ctx = nodes.EvalContext(extension.environment, template)
+        args = tuple(self._static_value(arg, eval_ctx) for arg in args)
+        kwargs = {
+            keyword.key: self._static_value(keyword.value, eval_ctx)
+            for keyword in kwargs
+        }
+        templates = extension.get_static_templates(args, kwargs)
+        self.usages[template].append(TagUsage(template, lineno, tag_name, args, kwargs, templates))
+
+    @staticmethod
+    def _static_value(node, eval_ctx):
+        try:
+            return node.as_const(eval_ctx)
+        except Exception:
+            return node
+
+    def find_tag(self, tag_name: str) -> List[TagUsage]:
+        """
+        Return the calls of the given tag in all templates.
+        """
+        return [
+            usage
+            for usages in self.usages.values()
+            for usage in usages
+            if usage.tag_name == tag_name
+        ]
+
+    def get_tag_templates(self, tag_name: str) -> set:
+        """
+        Return the names of the templates rendered by the given tag.
+        """
+        return {
+            name
+            for usage in self.find_tag(tag_name)
+            for name in usage.templates or ()
+        }
+
+    def affected_by_template(self, name: str) -> set:
+        """
+        Return the names of the templates that render the given template,
+        directly or through other templates (tags, includes, imports and
+        inheritance).
+        """
+        affected = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            for template, references in self.references.items():
+                if current in references and template not in affected:
+                    affected.add(template)
+                    pending.append(template)
+        return affected
+
+    def affected_by_tag(self, tag_name: str) -> set:
+        """
+        Return the names of the templates that call the given tag, directly
+        or through other templates.
+        """
+        affected = set()
+        for usage in self.find_tag(tag_name):
+            affected.add(usage.template)
+            affected.update(self.affected_by_template(usage.template))
+        return affected
+
+
+def build_index(environment: Environment, filter_func=None) -> TagIndex:
+    """
+    Parse every template that the loader of the environment can list
+    (optionally filtered with `filter_func`) and collect the tag calls
+    and the references between the templates.
+    """
+    from jinja2 import meta
+
+    index = TagIndex()
+    token = _current_index.set(index)
+    try:
+        for name in environment.list_templates(filter_func=filter_func):
+            source, filename, _ = environment.loader.get_source(environment, name)
+            index._template = name
+            index.usages[name] = []
+            ast = environment.parse(source, name, filename)
+
+            references = {
+                template_name
+                for template_name in meta.find_referenced_templates(ast)
+                if template_name is not None
+            }
+            for usage in index.usages[name]:
+                references.update(usage.templates or ())
+            index.references[name] = references
+    finally:
+        _current_index.reset(token)
+    return index
+
+
+def warm_up(environment: Environment, filter_func=None) -> List[str]:
+    """
+    Fill the caches of the tags registered in the environment and compile
+    every template that its loader can list (optionally filtered with
+    `filter_func`). Returns the names of the compiled templates.
+
+    Call this before forking worker processes, so that the workers share
+    the compiled templates instead of compiling them on the first request.
+    """
+    _warm_up_tags(environment)
+
+    try:
+        template_names = environment.list_templates(filter_func=filter_func)
+    except TypeError:
+        # the loader can't list its templates
+        return []
+
+    for name in template_names:
+        environment.get_template(name)
+    return template_names
+
+
+def _warm_up_tags(environment: Environment):
+    for extension in environment.extensions.values():
+        if isinstance(extension, BaseTemplateTag):
+            extension.warm_up()
+
+
+# The template rendered by a worker of `render_many()`.
+_worker_template = None  # type: Optional[Template]
+
+
+def _init_render_worker(environment, environment_factory, template_name):
+    global _worker_template
+    if environment_factory is not None:
+        environment = environment_factory()
+        _warm_up_tags(environment)
+    _worker_template = environment.get_template(template_name)
+
+
+def _render_chunk(contexts):
+    return [_worker_template.render(context) for context in contexts]
+
+
+def render_many(
+    template: Template,
+    contexts: Iterable[Dict[str, Any]],
+    workers: Optional[int] = None,
+    *,
+    chunk_size: int = 64,
+    environment_factory: Optional[Callable[[], Environment]] = None
+) -> Iterator[str]:
+    """
+    Render the template with each of the contexts and yield the results in order.
+
+    Without `workers` the contexts are rendered one by one in the current process.
+    Otherwise they are sent in chunks of `chunk_size` to a pool of processes,
+    each with a warm environment that serves all its renders. The workers are
+    forked from the current process and inherit the environment of the template,
+    or create their own with `environment_factory` (a picklable callable), which
+    is required where processes can't be forked. The template must be loaded
+    by name, and the contexts and results must be picklable.
+    """
+    import multiprocessing
+
+    if not workers:
+        for context in contexts:
+            yield template.render(context)
+        return
+
+    if template.name is None:
+        raise ValueError("render_many() with workers requires a template loaded by name")
+
+    if environment_factory is None:
+        try:
+            mp_context = multiprocessing.get_context("fork")
+        except ValueError:
+            raise ValueError(
+                "render_many() requires an environment_factory "
+                "where processes can't be forked"
+            ) from None
+
+        # The workers share the compiled templates and the tag caches
+        # of the current process. Forked workers inherit the arguments
+        # of the initializer, so the environment is not pickled.
+        _warm_up_tags(template.environment)
+        initargs = (template.environment, None, template.name)
+    else:
+        mp_context = multiprocessing.get_context()
+        initargs = (None, environment_factory, template.name)
+
+    pool = mp_context.Pool(workers, _init_render_worker, initargs)
+
+    try:
+        # A bounded number of chunks is in flight, so the contexts
+        # are consumed as the results are taken.
+        pending = deque()  # type: deque
+        iterator = iter(contexts)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if chunk:
+                pending.append(pool.apply_async(_render_chunk, (chunk,)))
+            if pending and (not chunk or len(pending) >= workers * 2):
+                yield from pending.popleft().get()
+            elif not chunk:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,9 +1,9 @@
 import datetime
 
 import pytest
-from jinja2 import Environment, TemplateSyntaxError
+from jinja2 import Environment, TemplateSyntaxError, nodes
 
-from jinja2_simple_tags import StandaloneTag
+from jinja2_simple_tags import ContainerTag, InclusionTag, StandaloneTag
 
 
 class DateTag(StandaloneTag):
@@ -14,6 +14,42 @@ class DateTag(StandaloneTag):
         return date.strftime(format_string)
 
 
+class WrapTag(ContainerTag):
+    tags = {"wrap"}
+
+    def render(self, tag, caller):
+        return "<{0}>{1}</{0}>".format(tag, caller())
+
+
+class GreetingTag(InclusionTag):
+    tags = {"greeting"}
+    template_name = "greeting.html"
+
+    def get_context(self, name):
+        return {
+            "name": name
+        }
+
+
+class LegacyNodeTag(StandaloneTag):
+    tags = {"legacy"}
+
+    def create_node(self, parser, args, kwargs, *, lineno, **options):
+        call_node = self.call_method("render_wrapper", args, kwargs, lineno=lineno)
+        return nodes.Output([call_node], lineno=lineno)
+
+    def render(self, value):
+        return "{}:{}:{}".format(self.tag_name, self.lineno, value)
+
+
+class FormatTag(StandaloneTag):
+    tags = {"format"}
+    arguments = ("value", "*args", "*", "sep=")
+
+    def render(self, value, *args, **kwargs):
+        return kwargs.get("sep", " ").join(map(str, (value,) + args))
+
+
 class TestArguments:
     def setup_method(self):
         self.env = Environment(extensions=[DateTag], autoescape=True)
@@ -53,3 +89,68 @@ class TestArguments:
         with pytest.raises(TemplateSyntaxError, match="Invalid argument syntax"):
             template = self.env.from_string("{% now '%d %B %Y', year=2008, month=4, as x %}")
             template.render({})
+
+
+class TestArgumentValidation:
+    def setup_method(self):
+        self.env = Environment(extensions=[DateTag, WrapTag, GreetingTag, LegacyNodeTag, FormatTag])
+
+    def test_too_many_arguments(self):
+        with pytest.raises(TemplateSyntaxError, match="Invalid arguments for tag 'now': too many positional"):
+            self.env.from_string("{% now '%d', 2008, 4, 8, 12 %}")
+
+    def test_unexpected_keyword(self):
+        with pytest.raises(TemplateSyntaxError, match="unexpected keyword argument 'hour'"):
+            self.env.from_string("{% now hour=12 %}")
+
+    def test_duplicate_keyword(self):
+        with pytest.raises(TemplateSyntaxError, match="duplicate keyword argument"):
+            self.env.from_string("{% now year=2008, year=2009 %}")
+
+    def test_container_arguments(self):
+        template = self.env.from_string("{% wrap 'b' %}text{% endwrap %}")
+        assert template.render() == "<b>text</b>"
+
+        with pytest.raises(TemplateSyntaxError, match="missing a required argument: 'tag'"):
+            self.env.from_string("{% wrap %}text{% endwrap %}")
+
+    def test_inclusion_arguments(self):
+        with pytest.raises(TemplateSyntaxError, match="Invalid arguments for tag 'greeting'"):
+            self.env.from_string("{% greeting %}")
+
+    def test_legacy_call_node(self):
+        template = self.env.from_string("\n{% legacy 'value' %}")
+        assert template.render() == "\nlegacy:2:value"
+
+    def test_argument_spec(self):
+        template = self.env.from_string("{% format 1, 2, 3, sep='-' %}")
+        assert template.render() == "1-2-3"
+
+        with pytest.raises(TemplateSyntaxError, match="missing a required argument: 'value'"):
+            self.env.from_string("{% format sep='-' %}")
+
+        with pytest.raises(TemplateSyntaxError, match="unexpected keyword argument 'end'"):
+            self.env.from_string("{% format 1, end='-' %}")
+
+    def test_invalid_argument_spec(self):
+        class InvalidSpecTag(StandaloneTag):
+            tags = {"invalid"}
+            arguments = ("value=", "other")
+
+            def render(self, value=None, other=None):
+                return ""
+
+        env = Environment(extensions=[InvalidSpecTag])
+        with pytest.raises(ValueError, match="Invalid argument spec"):
+            env.from_string("{% invalid %}")
+
+    def test_argument_check_cache(self):
+        extension = self.env.extensions[DateTag.identifier]
+        for year in range(3):
+            self.env.from_string("{{% now '%Y', year={} %}}".format(year))
+
+        assert extension._argument_errors == {(1, ("year",)): None}
+
+        for _ in range(2):
+            with pytest.raises(TemplateSyntaxError, match="unexpected keyword argument 'hour'"):
+                self.env.from_string("{% now hour=12 %}")
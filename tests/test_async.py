@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+from jinja2 import Environment, FileSystemLoader, TemplateSyntaxError
+
+import jinja2_simple_tags
+from jinja2_simple_tags import ContainerTag, InclusionTag, StandaloneTag
+
+
+class AsyncVariableTag(StandaloneTag):
+    tags = {"async_var"}
+
+    async def render(self, name):
+        await asyncio.sleep(0)
+        return "{}:{}".format(self.lineno, self.context.get(name))
+
+
+class SyncVariableTag(StandaloneTag):
+    tags = {"sync_var"}
+
+    def render(self, name):
+        return self.context.get(name)
+
+
+class AsyncTrimTag(ContainerTag):
+    tags = {"async_trim"}
+
+    async def render(self, caller=None):
+        content = await caller()
+        await asyncio.sleep(0)
+        return str(content).strip()
+
+
+class SyncTrimTag(ContainerTag):
+    tags = {"sync_trim"}
+
+    def render(self, caller=None):
+        return str(caller()).strip()
+
+
+class AsyncInputTag(InclusionTag):
+    tags = {"async_input"}
+    template_name = "input/default.html"
+
+    async def get_context(self, name, type_="text"):
+        await asyncio.sleep(0)
+        return {
+            "name": name,
+            "type": type_
+        }
+
+
+class SyncHeaderTag(InclusionTag):
+    tags = {"sync_header"}
+    template_name = "header/default.html"
+
+    def get_context(self, logo):
+        return {
+            "logo": logo
+        }
+
+
+class TestAsyncEnvironment:
+    def setup_method(self):
+        self.env = Environment(
+            loader=FileSystemLoader("tests/templates"),
+            extensions=[
+                AsyncVariableTag,
+                SyncVariableTag,
+                AsyncTrimTag,
+                SyncTrimTag,
+                AsyncInputTag,
+                SyncHeaderTag
+            ],
+            autoescape=True,
+            enable_async=True
+        )
+
+    def test_async_standalone(self):
+        template = self.env.from_string("{% async_var 'name' %}")
+        assert template.render({"name": "John"}) == "1:John"
+
+    def test_sync_standalone(self):
+        template = self.env.from_string("{% sync_var 'name' %}")
+        assert template.render({"name": "John"}) == "John"
+
+    def test_async_container(self):
+        template = self.env.from_string("{% async_trim %}  {% async_var 'name' %} {% endasync_trim %}")
+        assert template.render({"name": "John"}) == "1:John"
+
+    def test_sync_container(self):
+        template = self.env.from_string("{% sync_trim %}  {{ name }} {% endsync_trim %}")
+        assert template.render({"name": "John"}) == "John"
+
+    def test_assignment(self):
+        template = self.env.from_string(
+            "{% async_trim as data %}  {{ name }} {% endasync_trim %}"
+            "{% async_var 'name' as value %}"
+            "[{{ data }}|{{ value }}]"
+        )
+        assert template.render({"name": "John"}) == "[John|1:John]"
+
+    def test_async_inclusion(self):
+        template = self.env.from_string("{% async_input 'password', type_='password' %}")
+        assert template.render() == "<input type=\"password\" name=\"password\">"
+
+    def test_sync_inclusion(self):
+        template = self.env.from_string("{% sync_header '/logo.png' %}")
+        assert template.render({"theme": "dark"}) == (
+            "<header class=\"header header--dark\">\n"
+            "  <img src=\"/logo.png\" alt=\"\">\n"
+            "</header>"
+        )
+
+    def test_concurrent_tasks(self):
+        template = self.env.from_string("{% async_var 'name' %}/{% async_input name %}")
+
+        async def main():
+            return await asyncio.gather(*[
+                template.render_async({"name": "user{}".format(index)})
+                for index in range(10)
+            ])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+        assert results == [
+            "1:user{0}/<input type=\"text\" name=\"user{0}\">".format(index)
+            for index in range(10)
+        ]
+
+    def test_concurrent_tasks_without_contextvars(self, monkeypatch):
+        # the replacement of `ContextVar` used on Python 3.6
+        monkeypatch.setattr(jinja2_simple_tags, "_current_frame", jinja2_simple_tags._TaskLocalVar())
+        template = self.env.from_string(
+            "{% async_var 'name' %}/{% sync_trim %} {% sync_var 'name' %} {% endsync_trim %}"
+        )
+
+        async def main():
+            return await asyncio.gather(*[
+                template.render_async({"name": "user{}".format(index)})
+                for index in range(4)
+            ])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+        assert results == ["1:user{0}/user{0}".format(index) for index in range(4)]
+        assert jinja2_simple_tags._current_frame.get() is None
+
+
+class TestSyncEnvironment:
+    def test_async_tag_requires_async_environment(self):
+        env = Environment(extensions=[AsyncVariableTag])
+        with pytest.raises(TemplateSyntaxError, match="requires an environment with enable_async"):
+            env.from_string("{% async_var 'name' %}")
+
+    def test_async_context_requires_async_environment(self):
+        env = Environment(loader=FileSystemLoader("tests/templates"), extensions=[AsyncInputTag])
+        with pytest.raises(TemplateSyntaxError, match="requires an environment with enable_async"):
+            env.from_string("{% async_input 'name' %}")
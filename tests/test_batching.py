@@ -0,0 +1,116 @@
+import asyncio
+
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import CacheTag, DeferredTemplate, InclusionTag, StandaloneTag
+
+PRODUCTS = {
+    1: "Apple",
+    2: "Banana",
+    3: "Cherry & Co",
+}
+
+
+class ProductCardTag(InclusionTag):
+    tags = {"product_card"}
+    template_name = "product_card.html"
+    batches = []
+
+    def get_batch_key(self, product_id):
+        return product_id
+
+    def load_many(self, keys):
+        self.batches.append(keys)
+        return {key: PRODUCTS[key] for key in keys}
+
+    def get_context(self, product_id):
+        return {
+            "product": self.load(product_id)
+        }
+
+
+class ProductNameTag(StandaloneTag):
+    tags = {"product_name"}
+    batches = []
+
+    def get_batch_key(self, product_id):
+        return product_id
+
+    def load_many(self, keys):
+        self.batches.append(keys)
+        return {key: PRODUCTS[key] for key in keys}
+
+    def render(self, product_id):
+        return self.load(product_id)
+
+
+class AsyncProductNameTag(ProductNameTag):
+    tags = {"async_product_name"}
+
+    async def load_many(self, keys):
+        await asyncio.sleep(0)
+        self.batches.append(keys)
+        return {key: PRODUCTS[key] for key in keys}
+
+    async def render(self, product_id):
+        return await self.load_async(product_id)
+
+
+class TestBatching:
+    def setup_method(self):
+        ProductCardTag.batches = []
+        ProductNameTag.batches = []
+        AsyncProductNameTag.batches = []
+        self.env = Environment(
+            loader=DictLoader({
+                "product_card.html": "<div>{{ product }}:{% product_name 2 %}</div>",
+                "grid.html": "{% for id in ids %}{% product_card id %}{% endfor %}",
+            }),
+            extensions=[ProductCardTag, ProductNameTag, CacheTag],
+            autoescape=True
+        )
+        self.env.template_class = DeferredTemplate
+
+    def test_single_batch(self):
+        template = self.env.get_template("grid.html")
+        assert template.render({"ids": [1, 3, 1]}) == (
+            "<div>Apple:Banana</div>"
+            "<div>Cherry &amp; Co:Banana</div>"
+            "<div>Apple:Banana</div>"
+        )
+        assert ProductCardTag.batches == [[1, 3]]
+        assert ProductNameTag.batches == [[2]]
+
+    def test_escaping(self):
+        template = self.env.from_string("{% product_name 3 %}|{% autoescape false %}{% product_name 3 %}{% endautoescape %}")
+        assert template.render() == "Cherry &amp; Co|Cherry & Co"
+        assert ProductNameTag.batches == [[3]]
+
+    def test_assignment_is_rendered_in_place(self):
+        template = self.env.from_string("{% product_name 1 as name %}{{ name }}|{% product_name 2 %}")
+        assert template.render() == "Apple|Banana"
+        assert ProductNameTag.batches == [[1], [2]]
+
+    def test_cache_block(self):
+        template = self.env.from_string("{% cache 'k' %}{% product_name 3 %}{% endcache %}")
+        assert template.render() == "Cherry &amp; Co"
+        assert template.render() == "Cherry &amp; Co"
+        assert ProductNameTag.batches == [[3]]
+
+    def test_regular_template(self):
+        env = Environment(loader=self.env.loader, extensions=[ProductCardTag, ProductNameTag])
+        template = env.get_template("grid.html")
+        assert template.render({"ids": [1, 2]}) == "<div>Apple:Banana</div><div>Banana:Banana</div>"
+        assert ProductCardTag.batches == [[1], [2]]
+
+    def test_generate(self):
+        template = self.env.get_template("grid.html")
+        assert "".join(template.generate({"ids": [1, 2]})) == "<div>Apple:Banana</div><div>Banana:Banana</div>"
+        assert ProductCardTag.batches == [[1], [2]]
+
+    def test_async_environment(self):
+        env = Environment(extensions=[AsyncProductNameTag], enable_async=True)
+        env.template_class = DeferredTemplate
+        template = env.from_string("{% for id in ids %}{% async_product_name id %},{% endfor %}")
+        assert template.render({"ids": [1, 2, 3]}) == "Apple,Banana,Cherry & Co,"
+        assert AsyncProductNameTag.batches == [[1, 2, 3]]
@@ -0,0 +1,95 @@
+import warnings
+
+import pytest
+from jinja2 import DictLoader, Environment, FileSystemBytecodeCache, nodes
+
+from jinja2_simple_tags import CacheTag, ContainerTag, InclusionTag, StandaloneTag
+
+TEMPLATES = {
+    "button.html": "<button>{{ text }}</button>",
+    "page.html": (
+        "{% upper 'title' %}\n"
+        "{% upper name as value %}{{ value }}\n"
+        "{% wrap 'b' %}{{ name }}{% endwrap %}\n"
+        "{% button name %}\n"
+        "{% cache 'page' %}{{ name }}{% endcache %}\n"
+    ),
+}
+
+
+class UpperTag(StandaloneTag):
+    tags = {"upper"}
+
+    def render(self, value):
+        return value.upper()
+
+
+class WrapTag(ContainerTag):
+    tags = {"wrap"}
+
+    def render(self, tag, caller=None):
+        return "<{0}>{1}</{0}>".format(tag, caller())
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button.html"
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+class CountingEnvironment(Environment):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiled = []
+
+    def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+        self.compiled.append(name)
+        return super().compile(source, name, filename, raw, defer_init)
+
+
+def create_environment(bytecode_cache=None):
+    return CountingEnvironment(
+        loader=DictLoader(TEMPLATES),
+        extensions=[UpperTag, WrapTag, ButtonTag, CacheTag],
+        bytecode_cache=bytecode_cache
+    )
+
+
+class TestBytecodeCache:
+    def test_deterministic_code(self):
+        source = TEMPLATES["page.html"]
+        first = create_environment()
+        second = create_environment()
+
+        assert first.compile(source, "page.html", raw=True) == second.compile(source, "page.html", raw=True)
+        assert first.compile(source, "page.html") == second.compile(source, "page.html")
+
+    def test_round_trip(self, tmp_path):
+        env = create_environment(FileSystemBytecodeCache(str(tmp_path)))
+        output = env.get_template("page.html").render(name="John")
+        assert env.compiled == ["page.html", "button.html"]
+
+        env = create_environment(FileSystemBytecodeCache(str(tmp_path)))
+        assert env.get_template("page.html").render(name="John") == output
+        assert env.compiled == []
+
+    def test_deprecated_output_warns_once(self):
+        with pytest.warns(DeprecationWarning, match="\"output\" method"):
+            class LegacyTag(StandaloneTag):
+                tags = {"legacy"}
+
+                def output(self, parser, call_node, lineno, **options):
+                    return nodes.Output([call_node], lineno=lineno)
+
+                def render(self):
+                    return "legacy"
+
+        env = Environment(extensions=[LegacyTag])
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            assert env.from_string("{% legacy %}").render() == "legacy"
+            assert env.from_string("{% legacy %}").render() == "legacy"
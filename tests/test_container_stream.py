@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+
+import pytest
+from jinja2 import DictLoader, Environment, TemplateSyntaxError, nodes
+
+from jinja2_simple_tags import ContainerTag
+
+requires_derived_context = pytest.mark.skipif(
+    not hasattr(nodes, "DerivedContextReference"),
+    reason="requires Jinja2 2.11"
+)
+
+
+class StreamingHashTag(ContainerTag):
+    tags = {"hash"}
+
+    def render_stream(self, body, algorithm):
+        hasher = hashlib.new(algorithm)
+        for chunk in body:
+            hasher.update(str(chunk).encode())
+        yield hasher.hexdigest()
+
+
+class UpperTag(ContainerTag):
+    tags = {"upper"}
+
+    def render_stream(self, body, prefix=""):
+        yield prefix
+        for chunk in body:
+            yield chunk.upper()
+
+
+class LinenoTag(ContainerTag):
+    tags = {"lineno"}
+
+    def render_stream(self, body):
+        for chunk in body:
+            yield "{}:{}".format(self.lineno, chunk)
+
+
+class AsyncUpperTag(ContainerTag):
+    tags = {"async_upper"}
+
+    async def render_stream(self, body):
+        async for chunk in body:
+            await asyncio.sleep(0)
+            yield chunk.upper()
+
+
+@requires_derived_context
+class TestContainerStream:
+    def setup_method(self):
+        self.env = Environment(
+            loader=DictLoader({
+                "base.html": "<main>{% block content %}{% endblock %}</main>",
+                "page.html": (
+                    "{% extends 'base.html' %}"
+                    "{% block content %}{% upper %}{{ title }}{% endupper %}{% endblock %}"
+                ),
+            }),
+            extensions=[StreamingHashTag, UpperTag, LinenoTag],
+            autoescape=True
+        )
+
+    def test_output(self):
+        template = self.env.from_string("{% hash 'sha1' %}test {{ 'content' }}{% endhash %}")
+        assert template.render() == "1eebdf4fdc9fc7bf283031b93f9aef3338de9052"
+
+    def test_chunks(self):
+        template = self.env.from_string("{% upper '-' %}a{{ b }}c{% endupper %}")
+        assert list(template.generate(b="b")) == ["-", "A", "B", "C"]
+
+    def test_escaping(self):
+        template = self.env.from_string("{% upper '<' %}<p>{{ text }}</p>{% endupper %}")
+        assert template.render(text="<b>") == "&lt;<P>&LT;B&GT;</P>"
+
+    def test_local_variables(self):
+        template = self.env.from_string(
+            "{% for item in items %}{% set index = loop.index %}"
+            "{% upper %}{{ index }}.{{ item }} {% endupper %}"
+            "{% endfor %}"
+        )
+        assert template.render(items=["a", "b"]) == "1.A 2.B "
+
+    def test_assignment(self):
+        template = self.env.from_string("{% upper as value %}text{% endupper %}[{{ value }}]")
+        assert template.render() == "[TEXT]"
+
+    def test_macro(self):
+        template = self.env.from_string(
+            "{% macro shout(text) %}{% upper %}{{ text }}{% endupper %}{% endmacro %}"
+            "{{ shout('hi') }}"
+        )
+        assert template.render() == "HI"
+
+    def test_inheritance(self):
+        template = self.env.get_template("page.html")
+        assert template.render(title="title") == "<main>TITLE</main>"
+
+    def test_frame(self):
+        template = self.env.from_string("\n{% lineno %}text{% endlineno %}")
+        assert template.render() == "\n2:text"
+
+    def test_arguments(self):
+        with pytest.raises(TemplateSyntaxError, match="missing a required argument: 'algorithm'"):
+            self.env.from_string("{% hash %}text{% endhash %}")
+
+    def test_async(self):
+        env = Environment(extensions=[UpperTag, AsyncUpperTag], enable_async=True)
+        template = env.from_string(
+            "{% for item in items %}"
+            "{% upper '-' %}{{ item }}{% endupper %}"
+            "{% async_upper %}{{ item }}{% endasync_upper %}"
+            "{% endfor %}"
+        )
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(template.render_async(items=["a", "b"]))
+        finally:
+            loop.close()
+        assert result == "-AA-BB"
+
+    def test_async_tag_requires_async_environment(self):
+        env = Environment(extensions=[AsyncUpperTag])
+        with pytest.raises(TemplateSyntaxError, match="requires an environment with enable_async=True"):
+            env.from_string("{% async_upper %}text{% endasync_upper %}")
+
+
+@pytest.mark.skipif(hasattr(nodes, "DerivedContextReference"), reason="requires Jinja2 < 2.11")
+class TestUnsupportedJinja:
+    def test_streaming(self):
+        env = Environment(extensions=[UpperTag])
+        with pytest.raises(TemplateSyntaxError, match="requires Jinja2 2.11 or later"):
+            env.from_string("{% upper %}text{% endupper %}")
+
+    def test_lazy(self):
+        class LazyTag(ContainerTag):
+            tags = {"lazy"}
+            lazy = True
+
+            def render(self, caller=None):
+                return caller()
+
+        env = Environment(extensions=[LazyTag])
+        with pytest.raises(TemplateSyntaxError, match="requires Jinja2 2.11 or later"):
+            env.from_string("{% lazy as value %}text{% endlazy %}")
+        assert env.from_string("{% lazy %}text{% endlazy %}").render() == "text"
@@ -10,9 +10,18 @@ class VariableTag(StandaloneTag):
         return self.context.get(name)
 
 
+class FrameTag(StandaloneTag):
+    tags = {"frame"}
+    frames = []
+
+    def render(self):
+        self.frames.append(self.frame)
+        return "{}:{}:{}".format(self.template, self.lineno, self.tag_name)
+
+
 class TestContext:
     def setup_method(self):
-        self.env = Environment(extensions=[VariableTag])
+        self.env = Environment(extensions=[VariableTag, FrameTag])
 
     def test_existing_variable(self):
         template = self.env.from_string("{% var 'name' %}")
@@ -25,3 +34,14 @@ class TestContext:
         assert template.render({
             "name": "John"
         }) == "None"
+
+    def test_frame(self):
+        FrameTag.frames.clear()
+        template = self.env.from_string("{% frame %}\n{% for _ in [1, 2] %}{% frame %}{% endfor %}")
+        assert template.render() == "None:1:frame\nNone:2:frameNone:2:frame"
+
+        first, second, third = FrameTag.frames
+        assert not hasattr(first, "__dict__")
+        assert (first.template, first.lineno, first.tag_name) == (None, 1, "frame")
+        assert second is not third
+        assert second.site is third.site
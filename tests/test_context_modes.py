@@ -0,0 +1,123 @@
+import tracemalloc
+
+import pytest
+from jinja2 import Environment, FileSystemLoader
+
+from jinja2_simple_tags import InclusionTag
+
+
+class LayeredHeaderTag(InclusionTag):
+    tags = {"layered_header"}
+    template_name = "header/default.html"
+    context_mode = "layered"
+
+    def get_context(self, logo):
+        return {
+            "logo": logo
+        }
+
+
+class CopyHeaderTag(LayeredHeaderTag):
+    tags = {"copy_header"}
+    context_mode = "copy"
+
+
+class IsolatedHeaderTag(LayeredHeaderTag):
+    tags = {"isolated_header"}
+    context_mode = "isolated"
+
+
+class IsolatedThemedHeaderTag(LayeredHeaderTag):
+    tags = {"isolated_themed_header"}
+    context_mode = "isolated"
+    context_keys = ("theme", "missing")
+
+
+class InvalidModeHeaderTag(LayeredHeaderTag):
+    tags = {"invalid_header"}
+    context_mode = "invalid"
+
+
+class TestContextModes:
+    def setup_method(self):
+        self.env = Environment(
+            loader=FileSystemLoader("tests/templates"),
+            extensions=[
+                LayeredHeaderTag,
+                CopyHeaderTag,
+                IsolatedHeaderTag,
+                IsolatedThemedHeaderTag,
+                InvalidModeHeaderTag
+            ],
+            autoescape=True
+        )
+
+    @pytest.mark.parametrize("tag_name", ["layered_header", "copy_header"])
+    def test_inherited_variables(self, tag_name):
+        template = self.env.from_string(
+            "{% set theme = 'night' %}"
+            "{% " + tag_name + " '/logo.png' %}"
+        )
+        assert template.render({
+            "theme": "dark",
+            "logo": "/original.png"
+        }) == (
+            "<header class=\"header header--night\">\n"
+            "  <img src=\"/logo.png\" alt=\"\">\n"
+            "</header>"
+        )
+
+    def test_template_globals(self):
+        self.env.globals["theme"] = "global"
+        template = self.env.from_string("{% layered_header '/logo.png' %}")
+        assert template.render() == (
+            "<header class=\"header header--global\">\n"
+            "  <img src=\"/logo.png\" alt=\"\">\n"
+            "</header>"
+        )
+
+    def test_isolated(self):
+        template = self.env.from_string("{% isolated_header '/logo.png' %}")
+        assert template.render({
+            "theme": "dark"
+        }) == (
+            "<header class=\"header\">\n"
+            "  <img src=\"/logo.png\" alt=\"\">\n"
+            "</header>"
+        )
+
+    def test_isolated_context_keys(self):
+        template = self.env.from_string("{% isolated_themed_header '/logo.png' %}")
+        assert template.render({
+            "theme": "dark"
+        }) == (
+            "<header class=\"header header--dark\">\n"
+            "  <img src=\"/logo.png\" alt=\"\">\n"
+            "</header>"
+        )
+
+    def test_invalid_mode(self):
+        template = self.env.from_string("{% invalid_header '/logo.png' %}")
+        with pytest.raises(ValueError, match="Invalid context mode: 'invalid'"):
+            template.render()
+
+    @pytest.mark.parametrize("tag_name", ["layered_header", "isolated_header"])
+    def test_allocations(self, tag_name):
+        # Rendering with a large parent context should not copy it on every call.
+        context = {"var{}".format(index): index for index in range(2000)}
+        context["items"] = range(20)
+
+        def measure(name):
+            template = self.env.from_string(
+                "{% for _ in items %}{% " + name + " '/logo.png' %}{% endfor %}"
+            )
+            template.render(context)  # warm up
+            tracemalloc.start()
+            try:
+                # unlike `render()`, a shared context doesn't copy the variables
+                "".join(template.root_render_func(template.new_context(context, shared=True)))
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        assert measure(tag_name) * 2 < measure("copy_header")
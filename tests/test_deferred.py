@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import (
+    CacheTag,
+    DeferredTemplate,
+    InclusionTag,
+    MemoryCache,
+    StandaloneTag,
+)
+
+
+class WidgetTag(StandaloneTag):
+    tags = {"widget"}
+    deferred = True
+
+    def render(self, name, delay=0.1):
+        time.sleep(delay)
+        return "<{}:{}>".format(name, self.context.get("user"))
+
+
+class AsyncWidgetTag(StandaloneTag):
+    tags = {"async_widget"}
+    deferred = True
+
+    async def render(self, name, delay=0.1):
+        await asyncio.sleep(delay)
+        return "<{}>".format(name)
+
+
+class PanelTag(InclusionTag):
+    tags = {"panel"}
+    template_name = "panel.html"
+    deferred = True
+
+    def get_context(self, title):
+        return {
+            "title": title
+        }
+
+
+class CachedPanelTag(PanelTag):
+    tags = {"cached_panel"}
+    deferred = False
+    cache_backend = MemoryCache()
+
+
+class InlinePanelTag(PanelTag):
+    tags = {"inline_panel"}
+    deferred = False
+    inline = True
+
+
+class FailingTag(StandaloneTag):
+    tags = {"failing"}
+    deferred = True
+
+    def render(self):
+        raise ValueError("failed")
+
+
+class TestDeferredTags:
+    def setup_method(self):
+        self.env = Environment(
+            loader=DictLoader({
+                "panel.html": "[{{ title }}{% widget 'inner', delay=0.05 %}]",
+            }),
+            extensions=[WidgetTag, PanelTag, CachedPanelTag, InlinePanelTag, CacheTag, FailingTag],
+            autoescape=True
+        )
+        self.env.template_class = DeferredTemplate
+
+    def test_parallel_rendering(self):
+        template = self.env.from_string(
+            "{% widget 'weather' %}|{% widget 'recommendations' %}|{% widget 'badge' %}"
+        )
+        start = time.perf_counter()
+        assert template.render({"user": "John"}) == (
+            "&lt;weather:John&gt;|&lt;recommendations:John&gt;|&lt;badge:John&gt;"
+        )
+        assert time.perf_counter() - start < 0.25
+
+    def test_nested_deferred_tags(self):
+        template = self.env.from_string("{% panel 'A' %}{% panel 'B' %}")
+        assert template.render({"user": "John"}) == (
+            "[A&lt;inner:John&gt;][B&lt;inner:John&gt;]"
+        )
+
+    def test_nested_template_in_worker(self):
+        inner = self.env.from_string("{% widget 'x', delay=0 %}{% widget 'y', delay=0 %}")
+
+        class RenderTag(StandaloneTag):
+            tags = {"render_inner"}
+            deferred = True
+            safe_output = True
+
+            def render(self):
+                return inner.render(user=threading.current_thread().name.split("_")[0])
+
+        env = Environment(extensions=[RenderTag])
+        env.template_class = DeferredTemplate
+        template = env.from_string("{% render_inner %}{% render_inner %}")
+        assert template.render() == "&lt;x:jinja2&gt;&lt;y:jinja2&gt;" * 2
+
+    def test_cache_block(self):
+        template = self.env.from_string("{% cache 'k' %}{% widget 'a', delay=0 %}{% endcache %}")
+        assert template.render({"user": "John"}) == "&lt;a:John&gt;"
+        assert template.render({"user": "Jane"}) == "&lt;a:John&gt;"
+
+    def test_cached_tag(self):
+        CachedPanelTag.cache_backend.clear()
+        template = self.env.from_string("{% cached_panel 'A' %}")
+        assert template.render({"user": "John"}) == "[A&lt;inner:John&gt;]"
+        assert template.render({"user": "Jane"}) == "[A&lt;inner:John&gt;]"
+
+    def test_captured_output(self):
+        template = self.env.from_string(
+            "{% filter upper %}{% widget 'a', delay=0 %}{% endfilter %}|"
+            "{% set block %}{% panel 'B' %}{% endset %}{{ block|length }}|"
+            "{% macro m() %}{% widget 'c', delay=0 %}{% endmacro %}{{ m()|lower }}|"
+            "{% for i in [1] %}{% if i %}{% widget 'd', delay=0 %}{% endif %}{% endfor %}"
+        )
+        assert template.render({"user": "John"}) == (
+            "&LT;A:JOHN&GT;|21|&lt;c:john&gt;|&lt;d:John&gt;"
+        )
+
+    def test_captured_inline_tag(self):
+        template = self.env.from_string("{% filter upper %}{% inline_panel 'a' %}{% endfilter %}")
+        assert template.render({"user": "John"}) == "[A&LT;INNER:JOHN&GT;]"
+
+    def test_processed_include(self):
+        for source in [
+            "{% filter upper %}{% include 'panel.html' %}{% endfilter %}",
+            "{% set block %}{% include 'panel.html' %}{% endset %}{{ block|upper }}",
+            "{% block content %}{% include 'panel.html' %}{% endblock %}{{ self.content()|upper }}",
+        ]:
+            template = self.env.from_string(source)
+            with pytest.raises(RuntimeError, match="was processed by the template"):
+                template.render({"title": "A", "user": "John"})
+
+    def test_unprocessed_include(self):
+        template = self.env.from_string("{% set block %}{% include 'panel.html' %}{% endset %}{{ block }}")
+        assert template.render({"title": "A", "user": "John"}) == "[A&lt;inner:John&gt;]"
+
+    def test_nothing_deferred(self, monkeypatch):
+        monkeypatch.setattr("jinja2_simple_tags._PLACEHOLDER_RE", None)
+        template = self.env.from_string("{{ text }}")
+        assert template.render({"text": "\x02jst:0:0\x03"}) == "\x02jst:0:0\x03"
+
+    def test_placeholder_like_values(self):
+        template = self.env.from_string("{{ a }}{{ b }}{% widget 'x', delay=0 %}")
+        assert template.render({"a": "\x02jst:0\x03", "b": "\x02jst:0:0\x03", "user": "John"}) == (
+            "\x02jst:0\x03\x02jst:0:0\x03&lt;x:John&gt;"
+        )
+
+    def test_exception(self):
+        template = self.env.from_string("{% widget 'a', delay=0 %}{% failing %}")
+        with pytest.raises(ValueError, match="failed"):
+            template.render()
+
+    def test_regular_template(self):
+        env = Environment(extensions=[WidgetTag])
+        template = env.from_string("{% widget 'a', delay=0 %}")
+        assert template.render({"user": "John"}) == "<a:John>"
+
+    def test_async_environment(self):
+        env = Environment(extensions=[AsyncWidgetTag], enable_async=True)
+        env.template_class = DeferredTemplate
+        template = env.from_string("{% async_widget 'a' %}{% async_widget 'b' %}{% async_widget 'c' %}")
+        start = time.perf_counter()
+        assert template.render() == "<a><b><c>"
+        assert time.perf_counter() - start < 0.25
+
+    def test_async_captured_output(self):
+        env = Environment(extensions=[AsyncWidgetTag], enable_async=True)
+        env.template_class = DeferredTemplate
+        template = env.from_string("{% filter upper %}{% async_widget 'a', delay=0 %}{% endfilter %}")
+        assert template.render() == "<A>"
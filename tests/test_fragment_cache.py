@@ -0,0 +1,81 @@
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import CacheTag, MemoryCache, StandaloneTag
+
+
+class CounterTag(StandaloneTag):
+    tags = {"counter"}
+    calls = 0
+
+    def render(self):
+        CounterTag.calls += 1
+        return CounterTag.calls
+
+
+class SharedCacheTag(CacheTag):
+    tags = {"shared_cache"}
+    cache_backend = MemoryCache()
+
+
+class TestCacheTag:
+    def setup_method(self):
+        CounterTag.calls = 0
+        self.loader = DictLoader({
+            "page.html": "{% cache 'block' %}<b>{% counter %}</b>{% endcache %}"
+        })
+        self.env = Environment(loader=self.loader, extensions=[CacheTag, CounterTag], autoescape=True)
+
+    def test_body_is_not_rendered_on_hit(self):
+        template = self.env.from_string("{% cache 'block' %}<b>{% counter %}</b>{% endcache %}")
+        assert template.render() == "<b>1</b>"
+        assert template.render() == "<b>1</b>"
+        assert CounterTag.calls == 1
+
+    def test_vary_on(self):
+        template = self.env.from_string("{% cache 'block', user %}{{ user }}:{% counter %}{% endcache %}")
+        assert template.render({"user": "a"}) == "a:1"
+        assert template.render({"user": "b"}) == "b:2"
+        assert template.render({"user": "a"}) == "a:1"
+
+    def test_call_sites(self):
+        template = self.env.from_string(
+            "{% cache 'block' %}{% counter %}{% endcache %}\n"
+            "{% cache 'block' %}{% counter %}{% endcache %}"
+        )
+        assert template.render() == "1\n2"
+        assert template.render() == "1\n2"
+
+    def test_template_change(self):
+        template = self.env.get_template("page.html")
+        assert template.render() == "<b>1</b>"
+
+        self.loader.mapping["page.html"] = "{% cache 'block' %}<i>{% counter %}</i>{% endcache %}"
+        template = self.env.get_template("page.html")
+        assert template.render() == "<i>2</i>"
+        assert template.render() == "<i>2</i>"
+
+    def test_timeout(self):
+        backend = SharedCacheTag.cache_backend
+        backend.clear()
+        env = Environment(extensions=[SharedCacheTag, CounterTag])
+        template = env.from_string("{% shared_cache 'block', timeout=300 %}{% counter %}{% endshared_cache %}")
+        assert template.render() == "1"
+
+        (key, (expires, value)), = backend._data.items()
+        assert expires is not None
+        assert value == "1"
+
+    def test_assignment(self):
+        template = self.env.from_string(
+            "{% cache 'block' as fragment %}<b>{% counter %}</b>{% endcache %}"
+            "{{ fragment }}{{ fragment }}"
+        )
+        assert template.render() == "<b>1</b><b>1</b>"
+        assert template.render() == "<b>1</b><b>1</b>"
+
+    def test_async_environment(self):
+        env = Environment(extensions=[CacheTag, CounterTag], enable_async=True)
+        template = env.from_string("{% cache 'block' %}{% counter %}{% endcache %}")
+        assert template.render() == "1"
+        assert template.render() == "1"
+        assert CounterTag.calls == 1
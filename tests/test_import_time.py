@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+# Modules that importing the package must not pull in. They are only needed
+# by async environments, deferred rendering, logging and bulk rendering.
+DEFERRED_MODULES = {
+    "asyncio",
+    "concurrent.futures",
+    "logging",
+    "multiprocessing",
+    "jinja2.meta",
+}
+
+
+def get_import_times(statement):
+    """
+    Return the cumulative import time (in microseconds) of every module
+    imported by the statement, as reported by `python -X importtime`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime:
+    def test_deferred_modules(self):
+        baseline = get_import_times("import jinja2, markupsafe")
+        times = get_import_times("import jinja2_simple_tags")
+        assert "jinja2_simple_tags" in times
+
+        imported = (set(times) - set(baseline)) & DEFERRED_MODULES
+        assert imported == set()
@@ -0,0 +1,118 @@
+from jinja2 import DictLoader, Environment, nodes
+
+from jinja2_simple_tags import InclusionTag, StandaloneTag, build_index
+
+TEMPLATES = {
+    "base.html": "<main>{% block content %}{% endblock %}</main>",
+    "button.html": "<button>{% icon 'ok' %}{{ text }}</button>",
+    "card.html": "<h1>{{ title }}</h1>\n{% button 'Buy', size=2 %}",
+    "alert.html": "<p>{{ text }}</p>",
+    "alert_error.html": "<p class=\"error\">{{ text }}</p>",
+    "page.html": (
+        "{% extends 'base.html' %}{% block content %}\n"
+        "{% card title %}\n"
+        "{% alert 'error', 'Oops' %}{% alert level, 'Hmm' %}\n"
+        "{% endblock %}"
+    ),
+    "inline.html": "{% inline_button 'Go' %}",
+    "other.html": "{% include 'alert.html' %}",
+}
+
+
+class IconTag(StandaloneTag):
+    tags = {"icon"}
+
+    def render(self, name):
+        return name
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button.html"
+
+    def get_context(self, text, size=1):
+        return {
+            "text": text
+        }
+
+
+class InlineButtonTag(ButtonTag):
+    tags = {"inline_button"}
+    inline = True
+
+
+class CardTag(InclusionTag):
+    tags = {"card"}
+    template_name = "card.html"
+
+    def get_context(self, title):
+        return {
+            "title": title
+        }
+
+
+class AlertTag(InclusionTag):
+    tags = {"alert"}
+
+    def get_template_names(self, level, text):
+        return ["alert_{}.html".format(level), "alert.html"]
+
+    def get_context(self, level, text):
+        return {
+            "text": text
+        }
+
+
+class TestTagIndex:
+    def setup_method(self):
+        self.env = Environment(
+            loader=DictLoader(TEMPLATES),
+            extensions=[IconTag, ButtonTag, InlineButtonTag, CardTag, AlertTag]
+        )
+        self.index = build_index(self.env)
+
+    def test_usages(self):
+        button, = self.index.usages["card.html"]
+        assert (button.template, button.lineno, button.tag_name) == ("card.html", 2, "button")
+        assert button.args == ("Buy",)
+        assert button.kwargs == {"size": 2}
+        assert button.templates == ("button.html",)
+
+        assert self.index.usages["base.html"] == []
+
+    def test_dynamic_arguments(self):
+        card, static_alert, dynamic_alert = self.index.usages["page.html"]
+        assert isinstance(card.args[0], nodes.Name)
+        assert card.templates == ("card.html",)
+
+        assert static_alert.templates == ("alert_error.html", "alert.html")
+        assert isinstance(dynamic_alert.args[0], nodes.Name)
+        assert dynamic_alert.templates is None
+
+    def test_inline_expansion(self):
+        usage, = self.index.usages["inline.html"]
+        assert usage.tag_name == "inline_button"
+        assert [usage.tag_name for usage in self.index.find_tag("icon")] == ["icon"]
+
+    def test_tag_templates(self):
+        assert self.index.get_tag_templates("alert") == {"alert_error.html", "alert.html"}
+        assert self.index.get_tag_templates("icon") == set()
+
+    def test_references(self):
+        assert self.index.references["page.html"] == {
+            "base.html", "card.html", "alert_error.html", "alert.html"
+        }
+        assert self.index.references["other.html"] == {"alert.html"}
+
+    def test_affected(self):
+        assert self.index.affected_by_template("button.html") == {"card.html", "page.html", "inline.html"}
+        assert self.index.affected_by_template("alert.html") == {"page.html", "other.html"}
+        assert self.index.affected_by_tag("icon") == {"button.html", "card.html", "page.html", "inline.html"}
+
+    def test_filter(self):
+        index = build_index(self.env, filter_func=lambda name: name.startswith("card"))
+        assert list(index.usages) == ["card.html"]
+
+    def test_no_recording_outside_of_index(self):
+        template = self.env.from_string("{% button 'x' %}")
+        assert template.render() == "<button>okx</button>"
@@ -0,0 +1,184 @@
+import asyncio
+import traceback
+
+import pytest
+from jinja2 import DictLoader, Environment, TemplateSyntaxError, UndefinedError, select_autoescape
+
+from jinja2_simple_tags import InclusionTag
+
+TEMPLATES = {
+    "badge.html": "<span class=\"{{ theme }}\">{{ text }}</span>",
+    "badge.txt": "[{{ text }}]",
+    "base.html": "<div>{% block content %}{% endblock %}</div>",
+    "child.html": "{% extends 'base.html' %}{% block content %}{{ text }}{% endblock %}",
+    "tree.html": "{{ text }}{% if text %}{% tree '' %}{% endif %}",
+    "broken.html": "{{ text.missing.key }}",
+}
+
+
+class CountingLoader(DictLoader):
+    def __init__(self, mapping):
+        super().__init__(mapping)
+        self.lookups = []
+
+    def get_source(self, environment, template):
+        self.lookups.append(template)
+        return super().get_source(environment, template)
+
+
+class BadgeTag(InclusionTag):
+    tags = {"badge"}
+    template_name = "badge.html"
+    inline = True
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+class RuntimeBadgeTag(BadgeTag):
+    tags = {"runtime_badge"}
+    inline = False
+
+
+class IsolatedBadgeTag(BadgeTag):
+    tags = {"isolated_badge"}
+    context_mode = "isolated"
+    context_keys = ("theme",)
+
+
+class TextBadgeTag(BadgeTag):
+    tags = {"text_badge"}
+    template_name = "badge.txt"
+
+
+class ChildTag(BadgeTag):
+    tags = {"child"}
+    template_name = "child.html"
+
+
+class TreeTag(BadgeTag):
+    tags = {"tree"}
+    template_name = "tree.html"
+
+
+class BrokenTag(BadgeTag):
+    tags = {"broken"}
+    template_name = "broken.html"
+
+
+class AsyncBadgeTag(BadgeTag):
+    tags = {"async_badge"}
+
+    async def get_context(self, text):
+        await asyncio.sleep(0)
+        return {
+            "text": text
+        }
+
+
+class TestInlineInclusion:
+    def setup_method(self):
+        self.loader = CountingLoader(dict(TEMPLATES))
+        self.env = Environment(
+            loader=self.loader,
+            extensions=[
+                BadgeTag,
+                RuntimeBadgeTag,
+                IsolatedBadgeTag,
+                TextBadgeTag,
+                ChildTag,
+                TreeTag,
+                BrokenTag
+            ],
+            autoescape=select_autoescape(["html"], default_for_string=True)
+        )
+
+    def test_expanded_at_compile_time(self):
+        code = self.env.compile("{% badge 'New' %}", raw=True)
+        assert "invoke_inline" in code
+        assert "<span class=" in code
+
+        template = self.env.from_string("{% badge 'New' %}")
+        lookups = len(self.loader.lookups)
+        assert template.render(theme="dark") == "<span class=\"dark\">New</span>"
+        assert len(self.loader.lookups) == lookups
+
+    @pytest.mark.parametrize("source", [
+        "{% for text in ['a', '<b>'] %}{% {tag} text %}{% endfor %}",
+        "{% set theme = 'light' %}{% {tag} 'x' %}{{ theme }}",
+        "{% {tag} 'x' as value %}<{{ value }}>",
+        "{% {tag} text=missing %}",
+    ])
+    def test_same_output_as_runtime(self, source):
+        inline = self.env.from_string(source.replace("{tag}", "badge"))
+        runtime = self.env.from_string(source.replace("{tag}", "runtime_badge"))
+        assert inline.render(theme="dark") == runtime.render(theme="dark")
+
+    def test_local_variables_are_scoped(self):
+        env = Environment(
+            loader=DictLoader({"badge.html": "{% set text = text | upper %}{{ text }}"}),
+            extensions=[BadgeTag]
+        )
+        template = env.from_string("{% set text = 'outer' %}{% badge 'inner' %}:{{ text }}")
+        assert template.render() == "INNER:outer"
+
+    def test_isolated_context(self):
+        template = self.env.from_string("{% isolated_badge text %}")
+        assert template.render(theme="dark", text="x") == "<span class=\"dark\">x</span>"
+
+        template = self.env.from_string("{% set text = 'y' %}{% isolated_badge 'x' %}")
+        assert template.render(theme="dark") == "<span class=\"dark\">x</span>"
+
+    def test_autoescape_of_included_template(self):
+        template = self.env.from_string("{% text_badge '<b>' %}")
+        assert template.render() == "[<b>]"
+
+    def test_template_is_parsed_once(self):
+        template = self.env.from_string("{% badge 'a' %}\n{% badge 'b' %}")
+        self.env.from_string("{% badge 'c' %}")
+        assert template.render(theme="dark") == (
+            "<span class=\"dark\">a</span>\n<span class=\"dark\">b</span>"
+        )
+        assert self.loader.lookups.count("badge.html") == 1
+
+    def test_changed_template(self):
+        self.env.from_string("{% badge 'a' %}")
+        self.loader.mapping["badge.html"] = "<b>{{ text }}</b>"
+        assert self.env.from_string("{% badge 'a' %}").render() == "<b>a</b>"
+
+    def test_inheritance_is_not_inlined(self):
+        code = self.env.compile("{% child 'x' %}", raw=True)
+        assert "invoke_inline" not in code
+        assert self.env.from_string("{% child 'x' %}").render() == "<div>x</div>"
+
+    def test_recursion_is_not_inlined(self):
+        template = self.env.from_string("{% tree 'x' %}")
+        assert template.render() == "x"
+
+    def test_error_line(self):
+        template = self.env.from_string("\n\n{% broken 'x' %}")
+        with pytest.raises(UndefinedError) as exc_info:
+            template.render()
+
+        frames = [frame for frame in traceback.extract_tb(exc_info.tb) if frame.filename == "<template>"]
+        assert frames[-1].lineno == 3
+
+    def test_invalid_arguments(self):
+        with pytest.raises(TemplateSyntaxError, match="Invalid arguments for tag 'badge'"):
+            self.env.from_string("{% badge %}")
+
+    def test_async(self):
+        env = Environment(
+            loader=DictLoader(TEMPLATES),
+            extensions=[AsyncBadgeTag],
+            enable_async=True
+        )
+        template = env.from_string("{% async_badge 'x' %}")
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(template.render_async(theme="dark"))
+        finally:
+            loop.close()
+        assert result == "<span class=\"dark\">x</span>"
@@ -0,0 +1,235 @@
+import logging
+import time
+
+import pytest
+from jinja2 import DictLoader, Environment, nodes
+
+from jinja2_simple_tags import (
+    CacheTag,
+    ContainerTag,
+    DeferredTemplate,
+    InclusionTag,
+    MemoryCache,
+    SlowCallLogger,
+    StandaloneTag,
+    TagStats,
+)
+
+requires_derived_context = pytest.mark.skipif(
+    not hasattr(nodes, "DerivedContextReference"),
+    reason="requires Jinja2 2.11"
+)
+
+
+class SleepTag(StandaloneTag):
+    tags = {"sleep"}
+
+    def render(self, seconds=0):
+        time.sleep(seconds)
+        return "slept"
+
+
+class CachedTag(StandaloneTag):
+    tags = {"cached"}
+    cache_backend = MemoryCache()
+
+    def render(self, value):
+        return value
+
+
+class ListTag(InclusionTag):
+    tags = {"list"}
+    template_name = "list.html"
+    streaming = True
+
+    def get_context(self, items):
+        return {
+            "items": items
+        }
+
+
+class DeferredTag(StandaloneTag):
+    tags = {"deferred"}
+    deferred = True
+
+    def render(self, value):
+        return value
+
+
+class BatchedTag(StandaloneTag):
+    tags = {"batched"}
+
+    def get_batch_key(self, key):
+        return key
+
+    def load_many(self, keys):
+        return {key: key.upper() for key in keys}
+
+    def render(self, key):
+        return self.load(key)
+
+
+class InlineTag(InclusionTag):
+    tags = {"inline"}
+    template_name = "list.html"
+    inline = True
+
+    def get_context(self, items):
+        return {
+            "items": items
+        }
+
+
+class UpperTag(ContainerTag):
+    tags = {"upper"}
+    lazy = True
+
+    def render_stream(self, body):
+        for chunk in body:
+            yield chunk.upper()
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, tag_name, template, lineno, duration, cache_hit):
+        self.calls.append((tag_name, template, lineno, duration, cache_hit))
+
+
+class TestInstrumentation:
+    def setup_method(self):
+        CachedTag.cache_backend.clear()
+        self.recorder = Recorder()
+        self.env = Environment(
+            loader=DictLoader({
+                "page.html": "{% sleep %}\n{% sleep 0.1 %}",
+                "list.html": "{% for item in items %}{{ item }}{% endfor %}",
+            }),
+            extensions=[SleepTag, CachedTag, ListTag, CacheTag, DeferredTag, BatchedTag, InlineTag, UpperTag]
+        )
+        self.env.tag_observer = self.recorder
+
+    def test_disabled(self):
+        env = Environment(extensions=[SleepTag])
+        assert env.tag_observer is None
+        source = env.compile("{% sleep %}", raw=True)
+        assert "invoke_observed" not in source
+        assert env.from_string("{% sleep %}").render() == "slept"
+
+    def test_observer(self):
+        template = self.env.get_template("page.html")
+        assert template.render() == "slept\nslept"
+
+        (first, second) = self.recorder.calls
+        assert first[:3] == ("sleep", "page.html", 1)
+        assert second[:3] == ("sleep", "page.html", 2)
+        assert second[3] >= 0.01
+        assert first[4] is None
+
+    def test_cache_hit(self):
+        template = self.env.from_string("{% cached 'a' %}{% cached 'a' %}")
+        assert template.render() == "aa"
+        assert [call[4] for call in self.recorder.calls] == [False, True]
+
+    def test_fragment_cache_hit(self):
+        template = self.env.from_string("{% cache 'key' %}body{% endcache %}")
+        assert template.render() == "body"
+        assert template.render() == "body"
+        assert [call[4] for call in self.recorder.calls] == [False, True]
+
+    def test_streaming(self):
+        template = self.env.from_string("{% list items %}")
+        assert template.render({"items": [1, 2, 3]}) == "123"
+        assert [call[:3] for call in self.recorder.calls] == [("list", None, 1)]
+
+    def test_deferred_and_batched(self):
+        self.env.template_class = DeferredTemplate
+        template = self.env.from_string("{% deferred 'a' %}\n{% batched 'b' %}")
+        assert template.render() == "a\nB"
+        assert sorted(call[:3] for call in self.recorder.calls) == [
+            ("batched", None, 2), ("deferred", None, 1)
+        ]
+
+    @requires_derived_context
+    def test_inline_and_body_stream(self):
+        template = self.env.from_string("{% inline items %}\n{% upper %}x{% endupper %}")
+        assert template.render({"items": [1, 2]}) == "12\nX"
+        assert [call[:3] for call in self.recorder.calls] == [("inline", None, 1), ("upper", None, 2)]
+
+    @requires_derived_context
+    def test_lazy(self):
+        template = self.env.from_string("{% upper as value %}x{% endupper %}{{ value }}")
+        assert template.render() == "X"
+        assert [call[:3] for call in self.recorder.calls] == [("upper", None, 1)]
+
+    def test_async_environment(self):
+        env = Environment(
+            loader=self.env.loader,
+            extensions=[SleepTag, ListTag],
+            enable_async=True
+        )
+        env.tag_observer = self.recorder
+        template = env.from_string("{% sleep %}{% list items %}")
+        assert template.render({"items": [1, 2]}) == "slept12"
+        assert [call[:3] for call in self.recorder.calls] == [("sleep", None, 1), ("list", None, 1)]
+
+
+class TestTagStats:
+    def test_report(self):
+        stats = TagStats()
+        env = Environment(
+            loader=DictLoader({
+                "page.html": "{% for _ in range(10) %}{% sleep %}{% endfor %}\n{% sleep 0.05 %}"
+            }),
+            extensions=[SleepTag]
+        )
+        env.tag_observer = stats
+        env.get_template("page.html").render()
+
+        slow, fast = stats.report()
+        assert (slow["template"], slow["lineno"], slow["tag_name"]) == ("page.html", 2, "sleep")
+        assert slow["calls"] == 1
+        assert slow["p50"] == slow["max"] == slow["total"] >= 0.05
+
+        assert (fast["template"], fast["lineno"]) == ("page.html", 1)
+        assert fast["calls"] == 10
+        assert fast["cache_hits"] == 0
+        assert fast["p50"] <= fast["p90"] <= fast["p99"] <= fast["max"]
+
+        stats.reset()
+        assert stats.report() == []
+
+    def test_percentiles(self):
+        stats = TagStats()
+        for duration in range(1, 101):
+            stats("tag", "page.html", 1, duration, None)
+
+        report, = stats.report()
+        assert report["p50"] == 50
+        assert report["p90"] == 90
+        assert report["p99"] == 99
+        assert report["mean"] == 50.5
+
+    def test_max_samples(self):
+        stats = TagStats(max_samples=10)
+        for duration in range(100):
+            stats("tag", "page.html", 1, duration, True)
+
+        report, = stats.report()
+        assert report["calls"] == 100
+        assert report["cache_hits"] == 100
+        assert report["p50"] == 94
+
+
+class TestSlowCallLogger:
+    def test_logging(self, caplog):
+        env = Environment(extensions=[SleepTag])
+        env.tag_observer = SlowCallLogger(threshold=0.05)
+        template = env.from_string("{% sleep %}\n{% sleep 0.1 %}")
+
+        with caplog.at_level(logging.WARNING, logger="jinja2_simple_tags"):
+            template.render()
+
+        record, = caplog.records
+        assert record.getMessage().startswith("Slow tag call: 'sleep' at None:2 took")
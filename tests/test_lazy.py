@@ -0,0 +1,262 @@
+import asyncio
+
+import pytest
+from jinja2 import DictLoader, Environment, nodes
+
+from jinja2_simple_tags import (
+    ContainerTag,
+    InclusionTag,
+    LazyMarkup,
+    LazyOutput,
+    StandaloneTag,
+    TagStats,
+)
+
+requires_derived_context = pytest.mark.skipif(
+    not hasattr(nodes, "DerivedContextReference"),
+    reason="requires Jinja2 2.11"
+)
+
+
+class CountingTag(StandaloneTag):
+    tags = {"report"}
+    lazy = True
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.calls = 0
+
+    def render(self, title):
+        self.calls += 1
+        return "<h1>{}</h1>".format(title)
+
+
+class SafeTag(CountingTag):
+    tags = {"safe_report"}
+    safe_output = True
+
+
+class WrapTag(ContainerTag):
+    tags = {"wrap"}
+    lazy = True
+
+    def render(self, tag, caller=None):
+        return "<{0}>{1}</{0}>".format(tag, caller())
+
+
+class TwiceTag(ContainerTag):
+    tags = {"twice"}
+    lazy = True
+
+    def render(self, caller=None):
+        return caller() + "|" + caller()
+
+
+class RowsTag(ContainerTag):
+    tags = {"rows"}
+    lazy = True
+
+    def render_stream(self, body, count):
+        text = "".join(body)
+        for index in range(count):
+            yield "{}:{};".format(index, text)
+
+
+class CardTag(InclusionTag):
+    tags = {"card"}
+    template_name = "card.html"
+    lazy = True
+    inline = True
+
+    def get_context(self, title):
+        return {
+            "title": title
+        }
+
+
+class TestLazyOutput:
+    def setup_method(self):
+        self.env = Environment(
+            loader=DictLoader({
+                "card.html": "<div>{{ title }}</div>{% for item in items %}<p>{{ item }}</p>{% endfor %}",
+            }),
+            extensions=[CountingTag, SafeTag, WrapTag, RowsTag, CardTag]
+        )
+        self.tag = self.env.extensions[CountingTag.identifier]
+
+    def test_unused(self):
+        template = self.env.from_string("{% report 'Title' as value %}-")
+        assert template.render() == "-"
+        assert self.tag.calls == 0
+
+    def test_rendered_once(self):
+        template = self.env.from_string("{% report 'Title' as value %}{{ value }}{{ value }}{{ value|length }}")
+        assert template.render() == "<h1>Title</h1><h1>Title</h1>14"
+        assert self.tag.calls == 1
+
+    def test_value(self):
+        template = self.env.from_string("{% report 'Title' as value %}")
+        module = template.make_module()
+        assert isinstance(module.value, LazyOutput)
+        assert repr(module.value) == "<LazyOutput pending>"
+        assert str(module.value) == "<h1>Title</h1>"
+        assert repr(module.value) == "<LazyOutput rendered>"
+
+    @requires_derived_context
+    def test_same_output_as_eager(self):
+        class EagerCountingTag(CountingTag):
+            tags = {"eager_report"}
+            lazy = False
+
+        class EagerSafeTag(SafeTag):
+            tags = {"eager_safe_report"}
+            lazy = False
+
+        class EagerWrapTag(WrapTag):
+            tags = {"eager_wrap"}
+            lazy = False
+
+        env = Environment(
+            extensions=[CountingTag, SafeTag, WrapTag, EagerCountingTag, EagerSafeTag, EagerWrapTag],
+            autoescape=True
+        )
+        source = (
+            "{% {prefix}report '<b>' as a %}{% {prefix}safe_report '<b>' as b %}"
+            "{% {prefix}wrap 'p' as c %}{{ text }}{% end{prefix}wrap %}"
+            "{{ a }}|{{ b }}|{{ c }}"
+        )
+        lazy = env.from_string(source.replace("{prefix}", ""))
+        eager = env.from_string(source.replace("{prefix}", "eager_"))
+        assert lazy.render(text="<i>") == eager.render(text="<i>")
+        assert "<h1><b></h1>" in lazy.render(text="<i>")
+
+    def test_string_operations(self):
+        source = (
+            "{% {prefix}report 'lazy' as v %}"
+            "{{ v == '<h1>lazy</h1>' }} {{ v != 'x' }} {{ 'az' in v }} {{ v[1] }} {{ v.upper() }} "
+            "{{ v + '!' }} {{ '!' + v }} {{ v in ['<h1>lazy</h1>'] }} {{ {v: 1}['<h1>lazy</h1>'] }}"
+        )
+        expected = "True True True h <H1>LAZY</H1> <h1>lazy</h1>! !<h1>lazy</h1> True 1"
+        env = Environment(extensions=[CountingTag])
+        assert env.from_string(source.replace("{prefix}", "")).render() == expected
+
+        class EagerCountingTag(CountingTag):
+            tags = {"eager_report"}
+            lazy = False
+
+        env = Environment(extensions=[EagerCountingTag])
+        assert env.from_string(source.replace("{prefix}", "eager_")).render() == expected
+
+    def test_safe_filter(self):
+        class EagerCountingTag(CountingTag):
+            tags = {"eager_report"}
+            lazy = False
+
+        class EagerSafeTag(SafeTag):
+            tags = {"eager_safe_report"}
+            lazy = False
+
+        env = Environment(extensions=[CountingTag, SafeTag, EagerCountingTag, EagerSafeTag], autoescape=True)
+        source = (
+            "{% {prefix}report '<b>' as a %}{% {prefix}safe_report '<b>' as b %}"
+            "{{ a|safe }}|{{ b|safe }}|{{ a }}|{{ b }}|{{ a|e }}"
+        )
+        lazy = env.from_string(source.replace("{prefix}", "")).render()
+        assert lazy == env.from_string(source.replace("{prefix}", "eager_")).render()
+        assert lazy == "<h1><b></h1>|<h1><b></h1>|&lt;h1&gt;&lt;b&gt;&lt;/h1&gt;|<h1><b></h1>|&lt;h1&gt;&lt;b&gt;&lt;/h1&gt;"
+
+    @requires_derived_context
+    def test_value_class(self):
+        env = Environment(extensions=[CountingTag, SafeTag, WrapTag], autoescape=True)
+        module = env.from_string(
+            "{% report 'x' as a %}{% safe_report 'x' as b %}{% wrap 'p' as c %}{% endwrap %}"
+        ).make_module()
+        assert type(module.a) is LazyOutput
+        assert type(module.b) is LazyMarkup
+        assert type(module.c) is LazyMarkup
+        assert not hasattr(module.a, "__html__")
+
+        module = self.env.from_string("{% safe_report 'x' as b %}").make_module()
+        assert type(module.b) is LazyOutput
+
+    def test_ordering(self):
+        source = (
+            "{% {prefix}report 'm' as v %}"
+            "{{ v < '<h2>' }} {{ v <= '<h1>m</h1>' }} {{ v > '<h0>' }} {{ v >= '<h2>' }} "
+            "{{ '<h0>' < v }} {{ ['<h2>', v, '<h0>']|sort|join(',') }}"
+        )
+        expected = "True True True False True <h0>,<h1>m</h1>,<h2>"
+        env = Environment(extensions=[CountingTag])
+        assert env.from_string(source.replace("{prefix}", "")).render() == expected
+
+        class EagerCountingTag(CountingTag):
+            tags = {"eager_report"}
+            lazy = False
+
+        env = Environment(extensions=[EagerCountingTag])
+        assert env.from_string(source.replace("{prefix}", "eager_")).render() == expected
+
+    @requires_derived_context
+    def test_caller_called_twice(self):
+        class EagerTwiceTag(TwiceTag):
+            tags = {"eager_twice"}
+            lazy = False
+
+        env = Environment(extensions=[TwiceTag, EagerTwiceTag])
+        source = "{% {prefix}twice as v %}body{% end{prefix}twice %}{{ v }}"
+        assert env.from_string(source.replace("{prefix}", "")).render() == "body|body"
+        assert env.from_string(source.replace("{prefix}", "eager_")).render() == "body|body"
+
+    def test_comparison_of_values(self):
+        template = self.env.from_string(
+            "{% report 'x' as a %}{% report 'x' as b %}{% report 'y' as c %}"
+            "{{ a == b }} {{ a == c }} {{ a is undefined }} {{ a.missing is undefined }}"
+        )
+        assert template.render() == "True False False True"
+
+    @requires_derived_context
+    def test_container(self):
+        template = self.env.from_string(
+            "{% for item in items %}{% set index = loop.index %}"
+            "{% wrap 'li' as value %}{{ index }}.{{ item }}{% endwrap %}"
+            "{% if item != 'b' %}{{ value }}{% endif %}"
+            "{% endfor %}"
+        )
+        assert template.render(items=["a", "b", "c"]) == "<li>1.a</li><li>3.c</li>"
+
+    @requires_derived_context
+    def test_streaming_container(self):
+        template = self.env.from_string(
+            "{% rows 3 as value %}{{ text }}{% endrows %}"
+            "{% for chunk in value %}[{{ chunk }}]{% endfor %}|{{ value }}"
+        )
+        assert template.render(text="x") == "[0:x;][1:x;][2:x;]|0:x;1:x;2:x;"
+
+    def test_inclusion_chunks(self):
+        template = self.env.from_string("{% card 'Title' as value %}{{ value | join('') }}|{{ value }}")
+        assert template.render(items=[1, 2]) == "<div>Title</div><p>1</p><p>2</p>|<div>Title</div><p>1</p><p>2</p>"
+
+    def test_inclusion_is_not_inlined(self):
+        code = self.env.compile("{% card 'Title' as value %}", raw=True)
+        assert "invoke_lazy" in code
+        assert "invoke_inline" not in code
+
+    @requires_derived_context
+    def test_observer(self):
+        stats = TagStats()
+        self.env.tag_observer = stats
+        template = self.env.from_string("{% report 'x' as value %}{% rows 1 as rows %}{% endrows %}{{ value }}")
+        assert template.render() == "<h1>x</h1>"
+        assert [(row["tag_name"], row["calls"]) for row in stats.report()] == [("report", 1)]
+
+    def test_async_environment(self):
+        env = Environment(extensions=[CountingTag, WrapTag], enable_async=True)
+        template = env.from_string(
+            "{% report 'x' as a %}{% wrap 'p' as b %}y{% endwrap %}{{ a }}{{ b }}"
+        )
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(template.render_async())
+        finally:
+            loop.close()
+        assert result == "<h1>x</h1><p>y</p>"
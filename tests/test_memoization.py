@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import InclusionTag, MemoryCache, StandaloneTag
+
+
+class DictBackend:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+
+class MenuTag(StandaloneTag):
+    tags = {"menu"}
+    cache_backend = MemoryCache()
+    cache_context_keys = ("locale",)
+    calls = []
+
+    def render(self, name, depth=1):
+        self.calls.append((name, depth))
+        return "{}:{}:{}".format(name, depth, self.context.get("locale"))
+
+
+class UrlTag(StandaloneTag):
+    tags = {"url"}
+    cache_backend = DictBackend()
+    calls = []
+
+    def get_cache_key(self, name, **kwargs):
+        if kwargs:
+            return None
+        return name
+
+    def render(self, name, **kwargs):
+        self.calls.append(name)
+        return "/{}/".format(name)
+
+
+class SlowTag(StandaloneTag):
+    tags = {"slow"}
+    cache_backend = MemoryCache()
+    calls = []
+
+    def render(self, name):
+        self.calls.append(name)
+        time.sleep(0.05)
+        return name.upper()
+
+
+class AsyncSlowTag(StandaloneTag):
+    tags = {"async_slow"}
+    cache_backend = MemoryCache()
+    calls = []
+
+    async def render(self, name):
+        self.calls.append(name)
+        await asyncio.sleep(0.01)
+        return name.upper()
+
+
+class CardTag(InclusionTag):
+    tags = {"card"}
+    template_name = "card.html"
+    cache_backend = MemoryCache()
+    calls = []
+
+    def get_context(self, title):
+        self.calls.append(title)
+        return {
+            "title": title
+        }
+
+
+class TestMemoization:
+    def setup_method(self):
+        for tag in (MenuTag, UrlTag, SlowTag, AsyncSlowTag, CardTag):
+            tag.calls = []
+        MenuTag.cache_backend.clear()
+        UrlTag.cache_backend.data.clear()
+        SlowTag.cache_backend.clear()
+        AsyncSlowTag.cache_backend.clear()
+        CardTag.cache_backend.clear()
+
+        self.env = Environment(
+            loader=DictLoader({
+                "card.html": "<div>{{ title }}</div>"
+            }),
+            extensions=[MenuTag, UrlTag, SlowTag, CardTag],
+            autoescape=True
+        )
+
+    def test_cached_output(self):
+        template = self.env.from_string("{% menu 'main' %}|{% menu 'main' %}|{% menu 'main', depth=2 %}")
+        assert template.render({"locale": "en"}) == "main:1:en|main:1:en|main:2:en"
+        assert template.render({"locale": "en"}) == "main:1:en|main:1:en|main:2:en"
+        assert MenuTag.calls == [("main", 1), ("main", 2)]
+
+    def test_context_keys(self):
+        template = self.env.from_string("{% menu 'main' %}")
+        assert template.render({"locale": "en"}) == "main:1:en"
+        assert template.render({"locale": "de"}) == "main:1:de"
+        assert template.render({"locale": "en", "user": "John"}) == "main:1:en"
+        assert MenuTag.calls == [("main", 1), ("main", 1)]
+
+    def test_non_primitive_values_are_not_cached(self):
+        class Page:
+            def __repr__(self):
+                return "Page"
+
+        template = self.env.from_string("{% menu page %}|{% menu 'main', depth=(1, 2) %}")
+        assert template.render({"page": Page(), "locale": "en"}) == "Page:1:en|main:(1, 2):en"
+        assert template.render({"page": Page(), "locale": "en"}) == "Page:1:en|main:(1, 2):en"
+        # tuples of primitive values are still cached
+        assert [depth for name, depth in MenuTag.calls] == [1, (1, 2), 1]
+
+    def test_non_primitive_context_values_are_not_cached(self):
+        template = self.env.from_string("{% menu 'main' %}")
+        assert template.render({"locale": ["en"]}) == "main:1:[&#39;en&#39;]"
+        assert template.render({"locale": ["en"]}) == "main:1:[&#39;en&#39;]"
+        assert MenuTag.calls == [("main", 1), ("main", 1)]
+
+    def test_custom_backend_and_key(self):
+        template = self.env.from_string("{% url 'home' %}{% url 'home' %}{% url 'home', page=2 %}")
+        assert template.render() == "/home//home//home/"
+        assert UrlTag.calls == ["home", "home"]
+        assert list(UrlTag.cache_backend.data.values()) == ["/home/"]
+
+    def test_inclusion_tag(self):
+        template = self.env.from_string("{% card 'News' %}{% card 'News' %}")
+        assert template.render() == "<div>News</div><div>News</div>"
+        assert CardTag.calls == ["News"]
+
+    def test_stampede_protection(self):
+        template = self.env.from_string("{% slow 'menu' %}")
+        barrier = threading.Barrier(8)
+
+        def render(_):
+            barrier.wait()
+            return template.render()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(render, range(8))) == ["MENU"] * 8
+
+        assert SlowTag.calls == ["menu"]
+
+    def test_async_stampede_protection(self):
+        env = Environment(extensions=[AsyncSlowTag], enable_async=True)
+        template = env.from_string("{% async_slow 'menu' %}")
+
+        async def main():
+            return await asyncio.gather(*[
+                template.render_async()
+                for _ in range(8)
+            ])
+
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(main()) == ["MENU"] * 8
+        finally:
+            loop.close()
+
+        assert AsyncSlowTag.calls == ["menu"]
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import InclusionTag, StandaloneTag, TagProfiler
+
+
+class IconTag(StandaloneTag):
+    tags = {"icon"}
+
+    def render(self, name):
+        return "<i class=\"{}\"></i>".format(name)
+
+
+class FailTag(StandaloneTag):
+    tags = {"fail"}
+
+    def render(self):
+        raise ValueError("failed")
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button.html"
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+class CardTag(InclusionTag):
+    tags = {"card"}
+    template_name = "card.html"
+
+    def get_context(self, title):
+        return {
+            "title": title
+        }
+
+
+class StreamingCardTag(CardTag):
+    tags = {"streaming_card"}
+    streaming = True
+
+
+class TestTagProfiler:
+    def setup_method(self):
+        self.profiler = TagProfiler()
+        self.env = Environment(
+            loader=DictLoader({
+                "button.html": "<button>{% icon 'ok' %}{{ text }}</button>",
+                "card.html": "<h1>{{ title }}</h1>\n{% button 'Buy' %}{% button 'Share' %}",
+                "page.html": "{% card 'A' %}{% card 'B' %}\n{% icon 'logo' %}",
+                "stream.html": "{% streaming_card 'A' %}",
+            }),
+            extensions=[IconTag, FailTag, ButtonTag, CardTag, StreamingCardTag]
+        )
+        self.env.tag_observer = self.profiler
+
+    def find(self, items, tag_name):
+        return next(item for item in items if item["tag_name"] == tag_name)
+
+    def test_tree(self):
+        self.env.get_template("page.html").render()
+        report = self.profiler.report()
+        assert sorted(item["tag_name"] for item in report) == ["card", "icon"]
+
+        card = self.find(report, "card")
+        assert (card["template"], card["lineno"], card["included"]) == ("page.html", 1, "card.html")
+        assert card["calls"] == 2
+        assert card["size"] == len(
+            "<h1>A</h1>\n<button><i class=\"ok\"></i>Buy</button><button><i class=\"ok\"></i>Share</button>"
+            "<h1>B</h1>\n<button><i class=\"ok\"></i>Buy</button><button><i class=\"ok\"></i>Share</button>"
+        )
+
+        button = self.find(card["children"], "button")
+        assert (button["template"], button["lineno"], button["included"]) == ("card.html", 2, "button.html")
+        assert button["calls"] == 4
+
+        icon = self.find(button["children"], "icon")
+        assert (icon["template"], icon["lineno"], icon["included"]) == ("button.html", 1, None)
+        assert icon["calls"] == 4
+        assert icon["children"] == []
+
+        assert card["self"] <= card["total"]
+        assert card["total"] >= button["total"] >= icon["total"]
+        assert json.loads(json.dumps(report)) == report
+
+    def test_streaming(self):
+        "".join(self.env.get_template("stream.html").generate())
+        card, = self.profiler.report()
+        assert card["included"] == "card.html"
+        assert card["size"] > 0
+        assert self.find(card["children"], "button")["calls"] == 2
+
+    def test_collapsed(self):
+        self.env.get_template("page.html").render()
+        lines = self.profiler.collapsed().splitlines()
+        paths = [line.rsplit(" ", 1)[0] for line in lines]
+        assert "card (page.html:1);button (card.html:2);icon (button.html:1)" in paths
+        assert "icon (page.html:2)" in paths
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_failed_call(self):
+        with pytest.raises(ValueError):
+            self.env.from_string("{% fail %}").render()
+
+        fail, = self.profiler.report()
+        assert fail["calls"] == 1
+        assert self.profiler._active == {}
+
+    def test_reset(self):
+        self.env.get_template("page.html").render()
+        self.profiler.reset()
+        assert self.profiler.report() == []
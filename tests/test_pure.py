@@ -0,0 +1,73 @@
+import pytest
+from jinja2 import Environment
+
+from jinja2_simple_tags import StandaloneTag
+
+
+class IconTag(StandaloneTag):
+    pure = True
+    safe_output = True
+    tags = {"icon"}
+    calls = []
+
+    def render(self, name, size=16):
+        self.calls.append((name, size))
+        return "<svg class=\"icon-{}\" width=\"{}\"></svg>".format(name, size)
+
+
+class LabelTag(StandaloneTag):
+    pure = True
+    tags = {"label"}
+
+    def render(self, text):
+        return "{} ({})".format(text, self.lineno)
+
+
+class FailingTag(StandaloneTag):
+    pure = True
+    tags = {"failing"}
+
+    def render(self, value):
+        raise ValueError(value)
+
+
+class TestPureTag:
+    def setup_method(self):
+        IconTag.calls = []
+        self.env = Environment(extensions=[IconTag, LabelTag, FailingTag], autoescape=True)
+
+    def test_rendered_at_compile_time(self):
+        template = self.env.from_string("{% icon 'cart', size=24 %}")
+        assert IconTag.calls == [("cart", 24)]
+
+        for _ in range(3):
+            assert template.render() == "<svg class=\"icon-cart\" width=\"24\"></svg>"
+        assert IconTag.calls == [("cart", 24)]
+
+    def test_compiled_source(self):
+        source = self.env.compile("{% icon 'cart', size=24 %}", raw=True)
+        assert "invoke" not in source
+        assert "icon-cart" in source
+
+    def test_escaping(self):
+        template = self.env.from_string("{% label 'Rick & Morty' %}")
+        assert template.render() == "Rick &amp; Morty (1)"
+
+        env = Environment(extensions=[LabelTag])
+        template = env.from_string("\n{% label 'Rick & Morty' %}")
+        assert template.render() == "\nRick & Morty (2)"
+
+    def test_assignment(self):
+        template = self.env.from_string("{% label 'Rick & Morty' as text %}[{{ text }}]")
+        assert template.render() == "[Rick &amp; Morty (1)]"
+
+    def test_variable_arguments(self):
+        template = self.env.from_string("{% icon name %}")
+        assert IconTag.calls == []
+        assert template.render({"name": "user"}) == "<svg class=\"icon-user\" width=\"16\"></svg>"
+        assert IconTag.calls == [("user", 16)]
+
+    def test_errors_are_raised_at_runtime(self):
+        template = self.env.from_string("{% failing 'value' %}")
+        with pytest.raises(ValueError, match="value"):
+            template.render()
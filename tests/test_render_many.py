@@ -0,0 +1,124 @@
+import functools
+import multiprocessing
+import os
+import threading
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from jinja2_simple_tags import InclusionTag, StandaloneTag, render_many
+
+TEMPLATES = {
+    "greeting.html": "Hello, {% button name %}",
+    "button.html": "<b>{{ text }}</b>",
+}
+
+requires_fork = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method"
+)
+
+
+class PidTag(StandaloneTag):
+    tags = {"pid"}
+
+    def render(self):
+        return str(os.getpid())
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button.html"
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+def create_environment():
+    return Environment(loader=DictLoader(TEMPLATES), extensions=[PidTag, ButtonTag])
+
+
+class TestRenderMany:
+    def setup_method(self):
+        self.env = create_environment()
+        self.template = self.env.get_template("greeting.html")
+        self.contexts = [{"name": "user{}".format(index)} for index in range(100)]
+        self.expected = ["Hello, <b>user{}</b>".format(index) for index in range(100)]
+
+    def test_sequential(self):
+        assert list(render_many(self.template, iter(self.contexts))) == self.expected
+
+    @requires_fork
+    def test_forked_workers(self):
+        results = render_many(self.template, self.contexts, workers=2, chunk_size=7)
+        assert list(results) == self.expected
+
+    @requires_fork
+    def test_environment_factory(self):
+        results = render_many(self.template, self.contexts, workers=2, environment_factory=create_environment)
+        assert list(results) == self.expected
+
+    def test_template_without_name(self):
+        template = self.env.from_string("{% pid %}")
+        with pytest.raises(ValueError, match="loaded by name"):
+            next(render_many(template, [{}], workers=2))
+
+    @requires_fork
+    def test_workers_are_reused(self):
+        env = Environment(loader=DictLoader({"pid.html": "{% pid %}"}), extensions=[PidTag])
+        pids = set(render_many(env.get_template("pid.html"), [{}] * 50, workers=2, chunk_size=5))
+        assert 1 <= len(pids) <= 2
+        assert str(os.getpid()) not in pids
+
+    @requires_fork
+    def test_respawned_workers(self, monkeypatch):
+        # workers that exit after each chunk are replaced by the pool
+        context_class = type(multiprocessing.get_context("fork"))
+        monkeypatch.setattr(
+            context_class,
+            "Pool",
+            functools.partialmethod(context_class.Pool, maxtasksperchild=1)
+        )
+        results = render_many(self.template, self.contexts, workers=2, chunk_size=7)
+        assert list(results) == self.expected
+
+    @requires_fork
+    def test_concurrent_calls(self):
+        results = {}
+
+        def render(text):
+            env = Environment(loader=DictLoader(dict(TEMPLATES, **{"button.html": text})), extensions=[ButtonTag])
+            template = env.get_template("greeting.html")
+            results[text] = list(render_many(template, self.contexts, workers=2, chunk_size=7))
+
+        threads = [threading.Thread(target=render, args=(text,)) for text in ["a", "b", "c"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == {text: ["Hello, " + text] * 100 for text in ["a", "b", "c"]}
+
+    @requires_fork
+    def test_lazy_consumption(self):
+        consumed = []
+
+        def contexts():
+            for context in self.contexts:
+                consumed.append(context)
+                yield context
+
+        results = render_many(self.template, contexts(), workers=2, chunk_size=10)
+        assert next(results) == self.expected[0]
+        assert len(consumed) < len(self.contexts)
+        results.close()
+
+    @requires_fork
+    def test_error(self):
+        template = Environment(
+            loader=DictLoader({"error.html": "{{ 1 / value }}"})
+        ).get_template("error.html")
+        with pytest.raises(ZeroDivisionError):
+            list(render_many(template, [{"value": 1}, {"value": 0}], workers=2))
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from jinja2 import DictLoader, Environment, TemplateSyntaxError, nodes
+from jinja2.sandbox import ImmutableSandboxedEnvironment, SandboxedEnvironment, SecurityError
+
+from jinja2_simple_tags import ContainerTag, InclusionTag, StandaloneTag, TagStats
+
+TEMPLATES = {
+    "button.html": "<button>{{ text }}</button>",
+    "unsafe.html": "{{ text.__class__.__mro__ }}",
+    "append.html": "{{ items.append(text) }}",
+}
+
+requires_derived_context = pytest.mark.skipif(
+    not hasattr(nodes, "DerivedContextReference"),
+    reason="requires Jinja2 2.11"
+)
+
+
+class UpperTag(StandaloneTag):
+    tags = {"upper"}
+
+    def render(self, value):
+        return value.upper()
+
+
+class TrustedUpperTag(UpperTag):
+    tags = {"trusted_upper"}
+    trusted = True
+
+
+class TrustedWrapTag(ContainerTag):
+    tags = {"wrap"}
+    trusted = True
+
+    def render(self, tag, caller=None):
+        return "<{0}>{1}</{0}>".format(tag, caller())
+
+
+class TrustedStreamTag(ContainerTag):
+    tags = {"stream"}
+    trusted = True
+
+    def render_stream(self, body):
+        for chunk in body:
+            yield chunk.upper()
+
+
+class TrustedButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = "button.html"
+    trusted = True
+
+    def get_context(self, text):
+        return {
+            "text": text
+        }
+
+
+class UnsafeTag(TrustedButtonTag):
+    tags = {"unsafe"}
+    template_name = "unsafe.html"
+
+
+class AppendTag(TrustedButtonTag):
+    tags = {"append"}
+    template_name = "append.html"
+
+
+class StrictSandboxedEnvironment(SandboxedEnvironment):
+    """
+    Doesn't allow calling anything.
+    """
+    def is_safe_callable(self, obj):
+        return False
+
+
+EXTENSIONS = [UpperTag, TrustedUpperTag, TrustedWrapTag, TrustedStreamTag, TrustedButtonTag, UnsafeTag, AppendTag]
+
+
+class TestSandbox:
+    def setup_method(self):
+        self.env = SandboxedEnvironment(loader=DictLoader(TEMPLATES), extensions=EXTENSIONS)
+
+    @requires_derived_context
+    def test_trusted_calls_are_not_checked(self):
+        assert "environment.call(" in self.env.compile("{% upper 'a' %}", raw=True)
+        assert "environment.call(" not in self.env.compile("{% trusted_upper 'a' %}", raw=True)
+
+        env = StrictSandboxedEnvironment(loader=DictLoader(TEMPLATES), extensions=EXTENSIONS)
+        template = env.from_string(
+            "{% trusted_upper 'a' %}{% stream %}b{% endstream %}{% button 'c' %}{% trusted_upper 'd' as value %}{{ value }}"
+        )
+        assert template.render() == "AB<button>c</button>D"
+
+        with pytest.raises(SecurityError):
+            env.from_string("{% upper 'a' %}").render()
+
+    def test_trusted_call_is_not_reachable_from_templates(self):
+        with pytest.raises(TemplateSyntaxError):
+            self.env.from_string("{{ ctx | %s:invoke(none, 'a') }}" % TrustedUpperTag.identifier)
+
+    def test_call_block(self):
+        template = self.env.from_string("{% wrap 'b' %}{{ text }}{% endwrap %}")
+        assert template.render(text="x") == "<b>x</b>"
+
+    def test_unsandboxed_environment(self):
+        env = Environment(loader=DictLoader(TEMPLATES), extensions=EXTENSIONS)
+        assert not any(":" in name for name in env.filters)
+        assert env.from_string("{% trusted_upper 'a' %}{% button 'b' %}").render() == "A<button>b</button>"
+
+    def test_included_template_is_sandboxed(self):
+        assert self.env.from_string("{% button 'x' %}").render() == "<button>x</button>"
+        with pytest.raises(SecurityError):
+            self.env.from_string("{% unsafe 'x' %}").render()
+
+    def test_included_template_keeps_policy(self):
+        env = ImmutableSandboxedEnvironment(loader=DictLoader(TEMPLATES), extensions=EXTENSIONS)
+        with pytest.raises(SecurityError):
+            env.from_string("{% append 'x' %}").render(items=[])
+
+    def test_bytecode(self):
+        code = self.env.compile("{% trusted_upper 'a' %}")
+        env = SandboxedEnvironment(extensions=EXTENSIONS)
+        template = env.template_class.from_code(env, code, env.make_globals(None))
+        assert template.render() == "A"
+
+    def test_observer(self):
+        stats = TagStats()
+        self.env.tag_observer = stats
+        assert self.env.from_string("{% trusted_upper 'a' %}").render() == "A"
+        assert stats.report()[0]["calls"] == 1
+
+    def test_async(self):
+        env = SandboxedEnvironment(loader=DictLoader(TEMPLATES), extensions=EXTENSIONS, enable_async=True)
+        template = env.from_string("{% trusted_upper 'a' %}{% button 'b' %}")
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(template.render_async())
+        finally:
+            loop.close()
+        assert result == "A<button>b</button>"
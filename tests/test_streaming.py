@@ -0,0 +1,96 @@
+from jinja2 import Environment, FileSystemLoader
+
+from jinja2_simple_tags import InclusionTag
+
+
+class StreamingListTag(InclusionTag):
+    tags = {"stream_list"}
+    template_name = "list/default.html"
+    streaming = True
+
+    def get_context(self, items):
+        return {
+            "items": items
+        }
+
+
+class BufferedListTag(StreamingListTag):
+    tags = {"buffered_list"}
+    streaming = False
+
+
+class TrackingIterator:
+    def __init__(self, count):
+        self.count = count
+        self.consumed = 0
+
+    def __iter__(self):
+        for index in range(self.count):
+            self.consumed += 1
+            yield "<item {}>".format(index)
+
+
+class TestStreamingInclusionTag:
+    def setup_method(self):
+        self.env = Environment(
+            loader=FileSystemLoader("tests/templates"),
+            extensions=[StreamingListTag, BufferedListTag],
+            autoescape=True
+        )
+
+    def test_output(self):
+        template = self.env.from_string("{% stream_list items %}|{% buffered_list items %}")
+        expected = "<ul><li>&lt;item 0&gt;</li><li>&lt;item 1&gt;</li></ul>"
+        assert template.render({
+            "items": TrackingIterator(2)
+        }) == "{0}|{0}".format(expected)
+
+    def test_output_without_autoescape(self):
+        env = Environment(
+            loader=FileSystemLoader("tests/templates"),
+            extensions=[StreamingListTag]
+        )
+        template = env.from_string("{% stream_list items %}")
+        assert template.render({
+            "items": ["<b>"]
+        }) == "<ul><li><b></li></ul>"
+
+    def test_streaming(self):
+        items = TrackingIterator(100)
+        template = self.env.from_string("<main>{% stream_list items %}</main>")
+        stream = template.generate({"items": items})
+        assert next(stream) == "<main>"
+        assert next(stream) == "<ul>"
+        assert items.consumed == 0
+
+        next(stream)
+        assert items.consumed == 1
+
+        assert "".join(stream).endswith("</ul></main>")
+        assert items.consumed == 100
+
+    def test_buffered(self):
+        items = TrackingIterator(100)
+        template = self.env.from_string("<main>{% buffered_list items %}</main>")
+        stream = template.generate({"items": items})
+        assert next(stream) == "<main>"
+        next(stream)
+        assert items.consumed == 100
+
+    def test_assignment(self):
+        template = self.env.from_string("{% stream_list items as data %}[{{ data }}]")
+        assert template.render({
+            "items": [1]
+        }) == "[<ul><li>1</li></ul>]"
+
+    def test_async_environment(self):
+        env = Environment(
+            loader=FileSystemLoader("tests/templates"),
+            extensions=[StreamingListTag],
+            autoescape=True,
+            enable_async=True
+        )
+        template = env.from_string("{% stream_list items %}{% stream_list items as data %}{{ data }}")
+        assert template.render({
+            "items": [1]
+        }) == "<ul><li>1</li></ul><ul><li>1</li></ul>"
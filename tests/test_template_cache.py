@@ -0,0 +1,158 @@
+import pytest
+from jinja2 import DictLoader, Environment
+
+import jinja2_simple_tags
+from jinja2_simple_tags import InclusionTag, MemoryCache
+
+
+class CountingLoader(DictLoader):
+    def __init__(self, mapping):
+        super().__init__(mapping)
+        self.lookups = []
+
+    def get_source(self, environment, template):
+        self.lookups.append(template)
+        return super().get_source(environment, template)
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = (
+        "button/christmas.html",
+        "button/default.html"
+    )
+
+    def get_context(self, text="Click me"):
+        return {
+            "text": text
+        }
+
+
+class UncachedButtonTag(ButtonTag):
+    tags = {"uncached_button"}
+    template_cache_size = 0
+
+
+class ExpiringButtonTag(ButtonTag):
+    tags = {"expiring_button"}
+    template_cache_timeout = 60
+
+
+class TestTemplateCache:
+    def setup_method(self):
+        self.loader = CountingLoader({
+            "button/default.html": "<button>{{ text }}</button>"
+        })
+        self.env = Environment(
+            loader=self.loader,
+            extensions=[ButtonTag, UncachedButtonTag, ExpiringButtonTag],
+            autoescape=True,
+            auto_reload=False
+        )
+
+    def test_missing_candidates_are_not_looked_up_again(self):
+        template = self.env.from_string("{% button %}{% button 'Buy' %}")
+        assert template.render() == "<button>Click me</button><button>Buy</button>"
+        assert template.render() == "<button>Click me</button><button>Buy</button>"
+        assert self.loader.lookups.count("button/christmas.html") == 1
+
+    def test_disabled_cache(self):
+        template = self.env.from_string("{% uncached_button %}{% uncached_button %}")
+        assert template.render() == "<button>Click me</button><button>Click me</button>"
+        assert self.loader.lookups.count("button/christmas.html") == 2
+
+    def test_auto_reload(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(jinja2_simple_tags.time, "monotonic", lambda: now[0])
+
+        self.env.auto_reload = True
+        template = self.env.from_string("{% button %}")
+        assert template.render() == "<button>Click me</button>"
+        assert template.render() == "<button>Click me</button>"
+        assert self.loader.lookups.count("button/christmas.html") == 1
+
+        # a changed template is picked up immediately
+        self.loader.mapping["button/default.html"] = "<a>{{ text }}</a>"
+        assert template.render() == "<a>Click me</a>"
+
+        # a new candidate is picked up once the entry has expired
+        self.loader.mapping["button/christmas.html"] = "<a>{{ text }} *</a>"
+        assert template.render() == "<a>Click me</a>"
+
+        now[0] += ButtonTag.template_cache_reload_timeout
+        assert template.render() == "<a>Click me *</a>"
+
+    def test_auto_reload_without_cache(self, monkeypatch):
+        monkeypatch.setattr(ButtonTag, "template_cache_reload_timeout", None)
+        self.env.auto_reload = True
+        template = self.env.from_string("{% button %}{% button %}")
+        assert template.render() == "<button>Click me</button><button>Click me</button>"
+        assert self.loader.lookups.count("button/christmas.html") == 2
+
+    def test_auto_reload_timeout(self):
+        self.env.auto_reload = True
+        button = self.env.extensions[ButtonTag.identifier]
+        expiring_button = self.env.extensions[ExpiringButtonTag.identifier]
+        assert button.get_template_cache_timeout() == 1.0
+        assert expiring_button.get_template_cache_timeout() == 1.0
+
+        self.env.auto_reload = False
+        assert button.get_template_cache_timeout() is None
+        assert expiring_button.get_template_cache_timeout() == 60
+
+    def test_expiration(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(jinja2_simple_tags.time, "monotonic", lambda: now[0])
+
+        template = self.env.from_string("{% expiring_button %}")
+        assert template.render() == "<button>Click me</button>"
+
+        # a new candidate is picked up once the entry has expired
+        self.loader.mapping["button/christmas.html"] = "<button>{{ text }} *</button>"
+        assert template.render() == "<button>Click me</button>"
+
+        now[0] += 61
+        assert template.render() == "<button>Click me *</button>"
+
+
+class TestMemoryCache:
+    def test_get_set(self):
+        cache = MemoryCache()
+        assert cache.get("key") is None
+        assert cache.get("key", "default") == "default"
+
+        cache.set("key", "value")
+        assert cache.get("key") == "value"
+
+        cache.delete("key")
+        assert cache.get("key") is None
+
+    def test_max_size(self):
+        cache = MemoryCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    @pytest.mark.parametrize("default_timeout, timeout", [(10, None), (None, 10)])
+    def test_timeout(self, monkeypatch, default_timeout, timeout):
+        now = [1000.0]
+        monkeypatch.setattr(jinja2_simple_tags.time, "monotonic", lambda: now[0])
+
+        cache = MemoryCache(timeout=default_timeout)
+        cache.set("key", "value", timeout=timeout)
+        now[0] += 9
+        assert cache.get("key") == "value"
+        now[0] += 1
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_clear(self):
+        cache = MemoryCache()
+        cache.set("a", 1)
+        cache.clear()
+        assert len(cache) == 0
@@ -0,0 +1,56 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jinja2 import Environment
+
+from jinja2_simple_tags import ContainerTag, StandaloneTag
+
+
+class SlowVariableTag(StandaloneTag):
+    tags = {"slow_var"}
+
+    def render(self, name):
+        lineno = self.lineno
+        time.sleep(0.001)  # let other threads overwrite the shared state
+        return "{}:{}:{}".format(lineno, self.lineno, self.context.get(name))
+
+
+class SlowContainerTag(ContainerTag):
+    tags = {"slow_block"}
+
+    def render(self, caller=None):
+        context = self.context
+        time.sleep(0.001)
+        assert self.context is context
+        return "{}[{}]".format(self.context.get("name"), caller())
+
+
+class TestThreadSafety:
+    def setup_method(self):
+        self.env = Environment(extensions=[SlowVariableTag, SlowContainerTag])
+
+    def test_state_outside_render(self):
+        extension = self.env.extensions[SlowVariableTag.identifier]
+        assert extension.frame is None
+        assert extension.context is None
+        assert extension.lineno is None
+
+    def test_concurrent_renders(self):
+        template = self.env.from_string(
+            "{% slow_var 'name' %}\n"
+            "{% slow_block %}{% slow_var 'name' %}{% endslow_block %}"
+        )
+        barrier = threading.Barrier(8)
+
+        def render(index):
+            barrier.wait()
+            return template.render({"name": "user{}".format(index)})
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(5):
+                results = list(executor.map(render, range(8)))
+                assert results == [
+                    "1:1:user{0}\nuser{0}[2:2:user{0}]".format(index)
+                    for index in range(8)
+                ]
@@ -0,0 +1,100 @@
+import pytest
+from jinja2 import DictLoader, Environment, FunctionLoader, TemplateNotFound
+
+from jinja2_simple_tags import InclusionTag, StandaloneTag, warm_up
+
+
+class CountingLoader(DictLoader):
+    def __init__(self, mapping):
+        super().__init__(mapping)
+        self.lookups = []
+
+    def get_source(self, environment, template):
+        self.lookups.append(template)
+        return super().get_source(environment, template)
+
+
+class ButtonTag(InclusionTag):
+    tags = {"button"}
+    template_name = (
+        "button/christmas.html",
+        "button/default.html"
+    )
+
+    def get_context(self, text="Click me"):
+        return {
+            "text": text
+        }
+
+
+class DynamicButtonTag(InclusionTag):
+    tags = {"dynamic_button"}
+
+    def get_context(self, style, text="Click me"):
+        return {
+            "text": text
+        }
+
+    def get_template_names(self, style, text="Click me"):
+        return "button/{}.html".format(style)
+
+
+class UpperTag(StandaloneTag):
+    tags = {"upper"}
+
+    def render(self, value):
+        return value.upper()
+
+
+class TestWarmUp:
+    def setup_method(self):
+        self.loader = CountingLoader({
+            "button/default.html": "<button>{{ text }}</button>",
+            "index.html": "{% button %}{% upper 'title' %}",
+            "about.txt": "{% upper 'about' %}",
+        })
+        self.env = Environment(
+            loader=self.loader,
+            extensions=[ButtonTag, DynamicButtonTag, UpperTag],
+            auto_reload=False
+        )
+
+    def test_compiles_templates(self):
+        assert sorted(warm_up(self.env)) == ["about.txt", "button/default.html", "index.html"]
+
+        self.loader.lookups.clear()
+        template = self.env.get_template("index.html")
+        assert template.render() == "<button>Click me</button>TITLE"
+        assert self.loader.lookups == []
+
+    def test_filter(self):
+        assert warm_up(self.env, filter_func=lambda name: name.endswith(".txt")) == ["about.txt"]
+
+    def test_inclusion_template(self):
+        warm_up(self.env)
+
+        extension = self.env.extensions[ButtonTag.identifier]
+        assert extension.template_cache.get(ButtonTag.template_name).name == "button/default.html"
+
+        template = self.env.from_string("{% button %}")
+        assert template.render() == "<button>Click me</button>"
+        assert self.loader.lookups.count("button/christmas.html") == 1
+
+    def test_signatures(self):
+        warm_up(self.env)
+        extension = self.env.extensions[UpperTag.identifier]
+        assert extension._signatures is not None
+
+    def test_missing_inclusion_template(self):
+        env = Environment(loader=DictLoader({}), extensions=[ButtonTag])
+        with pytest.raises(TemplateNotFound):
+            warm_up(env)
+
+    def test_loader_without_listing(self):
+        env = Environment(
+            loader=FunctionLoader(lambda name: "<button>{{ text }}</button>"),
+            extensions=[ButtonTag],
+            auto_reload=False
+        )
+        assert warm_up(env) == []
+        assert env.extensions[ButtonTag.identifier].template_cache.get(ButtonTag.template_name) is not None